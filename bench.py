@@ -0,0 +1,68 @@
+"""Бенчмарк страниц на локальной базе (fake_supabase.py) через streamlit.testing AppTest.
+
+    python bench.py                          # все страницы + карточка, 10k/50k/30k/20k строк
+    python bench.py --size 2000,10000,6000,4000 --runs 10 Pipeline Kanban
+
+Для каждой страницы: холодный перезапуск (после очистки st.cache_data и st.cache_resource) и теплые перезапуски —
+время (мс), число запросов, строк и время в базе. Для карточки — открытие и повторный перезапуск.
+"""
+import argparse
+import os
+import statistics
+import time
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+PAGES = ["Pipeline", "Kanban", "Dashboard", "Contacts", "Samples", "Alertes", "Import", "Perf"]
+
+
+def measure(client, run):
+    """(мс, запросов, строк, мс в базе) одного перезапуска"""
+    client.reset_log()
+    t0 = time.perf_counter()
+    at = run()
+    ms = (time.perf_counter() - t0) * 1000
+    if at.exception: raise RuntimeError(f"{at.exception[0].value}")
+    return ms, len(client.log), sum(q["rows"] for q in client.log), sum(q["ms"] for q in client.log)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("pages", nargs="*", help=f"страницы (по умолчанию все: {', '.join(PAGES)}) и 'Fiche'")
+    ap.add_argument("--size", default=os.environ.get("FAKE_DB_SIZE", "10000,50000,30000,20000"), help="prospects,samples,contacts,activities")
+    ap.add_argument("--runs", type=int, default=5, help="теплых перезапусков на страницу")
+    ap.add_argument("--timeout", type=float, default=600)
+    args = ap.parse_args()
+
+    os.environ.update(INGOOD_FAKE_DB="1", INGOOD_FAKE_AI="1", FAKE_DB_SIZE=args.size)
+    os.chdir(os.path.dirname(APP))  # приложение открывает favicon.png и пр. относительно своей папки
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    from fake_supabase import shared_client
+
+    t0 = time.perf_counter(); client = shared_client()
+    print(f"data {args.size}: {(time.perf_counter() - t0):.1f}s")
+    at = AppTest.from_file(APP, default_timeout=args.timeout)
+    at.run()
+    if at.exception: raise SystemExit(f"app failed: {at.exception[0].value}")
+
+    rows = []
+    for page in args.pages or PAGES + ["Fiche"]:
+        if page == "Fiche":
+            pid = client.tables["prospects"][0]["id"]
+            at.radio[0].set_value("Pipeline").run()
+            def run(): at.session_state["active_prospect_id"] = pid; return at.run()
+        else:
+            def run(page=page): return at.radio[0].set_value(page).run()
+        st.cache_data.clear(); st.cache_resource.clear()  # live-store, алерты и индекс контактов живут в cache_resource
+        cold = measure(client, run)
+        warm = [measure(client, run) for _ in range(args.runs)]
+        rows.append((page, cold, [statistics.median(w[i] for w in warm) for i in range(4)], max(w[0] for w in warm)))
+        if "active_prospect_id" in at.session_state: del at.session_state["active_prospect_id"]
+
+    print(f"{'page':<10} {'cold ms':>9} {'q':>4} {'rows':>7} {'db ms':>7} | {'warm p50':>9} {'max':>7} {'q':>4} {'rows':>7} {'db ms':>7}")
+    for page, c, w, mx in rows:
+        print(f"{page:<10} {c[0]:>9.0f} {c[1]:>4} {c[2]:>7} {c[3]:>7.1f} | {w[0]:>9.0f} {mx:>7.0f} {w[1]:>4.0f} {w[2]:>7.0f} {w[3]:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Локальная заглушка google.generativeai.GenerativeModel для работы без ключа Gemini.
+
+Включается переменной окружения INGOOD_FAKE_AI=1 (см. _new_ai_model в streamlit_app.py).
+FAKE_AI_DELAY — пауза между фрагментами потока (сек.), FAKE_AI_FAIL — список вариантов через запятую,
+которые должны падать: "gemini-1.5-flash+search" (с Google Search), "gemini-1.5-flash", "gemini-1.5-pro".
+"""
+import os
+import re
+import time
+from types import SimpleNamespace
+
+
+class FakeGenerativeModel:
+    calls = []  # (model, grounded) каждого вызова — для проверки цепочки fallback
+
+    def __init__(self, model_name, tools=None, **kwargs):
+        self.model_name, self.grounded = model_name, bool(tools)
+
+    def _tag(self):
+        return self.model_name + ("+search" if self.grounded else "")
+
+    def _text(self, prompt):
+        cible = re.search(r"Cible : (.*?)\. Produit : (.*?)\. Ton : (.*?)\.", prompt)
+        company, product, tone = cible.groups() if cible else ("Client", "LENGOOD®", "Professionnel")
+        return (f"Objet : {product} pour {company}\n\nBonjour,\n\nSuite à nos échanges, je me permets de revenir vers vous "
+                f"au sujet de {product}. Ton : {tone}. Nous serions ravis d'organiser un essai dans votre atelier "
+                f"et de partager nos fiches techniques.\n\nBien cordialement,\nIngood Growth ({self._tag()})")
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        FakeGenerativeModel.calls.append((self.model_name, self.grounded))
+        fail = {x.strip() for x in os.environ.get("FAKE_AI_FAIL", "").split(",") if x.strip()}
+        if self._tag() in fail:
+            raise RuntimeError(f"{self._tag()} indisponible (fake)")
+        text, delay = self._text(prompt), float(os.environ.get("FAKE_AI_DELAY", "0.02"))
+        if not stream:
+            time.sleep(delay * 5)
+            return SimpleNamespace(text=text)
+
+        def chunks():
+            for part in re.findall(r"\S+\s*", text):
+                time.sleep(delay)
+                yield SimpleNamespace(text=part)
+        return chunks()
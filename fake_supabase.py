@@ -0,0 +1,307 @@
+"""Локальная база в памяти вместо supabase.Client — запуск без ключей и бенчмарки (bench.py).
+
+Включается переменной окружения INGOOD_FAKE_DB=1 (см. init_connections в streamlit_app.py).
+FAKE_DB_SIZE — "prospects,samples,contacts,activities" (по умолчанию 10000,50000,30000,20000), FAKE_DB_SEED — seed.
+Поддерживает цепочку запросов приложения: table().select() / insert / update / upsert / delete,
+фильтры eq/neq/in_/is_/lt/lte/gt/gte/ilike, order / limit / range (и для вложенных таблиц через foreign_table),
+count="exact", вложенные выборки "prospects(company_name)", "prospects!inner(...)", "*, contacts(*)".
+FakeClient.changes — журнал (table, kind, row) всех записей: локальный источник дельт для live-store (FeedSource).
+"""
+import copy
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+PARENTS = {"prospect_id": "prospects"}
+
+
+def _singular(t):
+    return t[:-1] if t.endswith("s") else t
+
+
+def _split_top(s):
+    """Делит 'a, b(c, d), e' по запятым верхнего уровня"""
+    out, depth, cur = [], 0, ""
+    for ch in s:
+        if ch == "(": depth += 1
+        elif ch == ")": depth -= 1
+        if ch == "," and depth == 0:
+            out.append(cur.strip()); cur = ""
+        else: cur += ch
+    if cur.strip(): out.append(cur.strip())
+    return out
+
+
+def _parse_select(s):
+    cols, embeds = [], []
+    for part in _split_top(s or "*"):
+        m = re.match(r"^(\w+)(!inner)?\((.*)\)$", part, re.S)
+        if m: embeds.append((m.group(1), bool(m.group(2)), _parse_select(m.group(3))))
+        else: cols.append(part)
+    return cols, embeds
+
+
+def _like(pattern):
+    rx = "^" + ".*".join(re.escape(p) for p in pattern.split("%")) + "$"
+    return re.compile(rx, re.I | re.S)
+
+
+def _cmp_key(v):
+    return (v is None, v if v is not None else 0)
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.c, self.t = client, table
+        self.op, self.payload, self.sel, self.count = "select", None, "*", None
+        self.filters, self.orders, self.rng, self.lim = [], [], None, None
+        self.sub_orders, self.sub_limits, self.upsert_defaults_null = {}, {}, True
+
+    # --- builders ---
+    def select(self, *cols, count=None, head=None):
+        self.sel = ", ".join(cols) if cols else "*"; self.count = count; return self
+
+    def insert(self, json, **kw):
+        self.op, self.payload = "insert", json; return self
+
+    def upsert(self, json, default_to_null=True, on_conflict="", **kw):
+        self.op, self.payload, self.upsert_defaults_null = "upsert", json, default_to_null
+        self.on_conflict = on_conflict or "id"; return self
+
+    def update(self, json, **kw):
+        self.op, self.payload = "update", json; return self
+
+    def delete(self, **kw):
+        self.op = "delete"; return self
+
+    def _f(self, col, fn):
+        self.filters.append((col, fn)); return self
+
+    def eq(self, col, v): return self._f(col, lambda x: x == v or (x is not None and v is not None and str(x) == str(v)))
+    def neq(self, col, v): return self._f(col, lambda x: x != v)
+    def in_(self, col, vs): vs = set(vs); return self._f(col, lambda x: x in vs)
+    def is_(self, col, v): return self._f(col, lambda x: x is None if v in ("null", None) else x is v)
+    def lt(self, col, v): return self._f(col, lambda x: x is not None and x < v)
+    def lte(self, col, v): return self._f(col, lambda x: x is not None and x <= v)
+    def gt(self, col, v): return self._f(col, lambda x: x is not None and x > v)
+    def gte(self, col, v): return self._f(col, lambda x: x is not None and x >= v)
+    def ilike(self, col, pattern): rx = _like(pattern); return self._f(col, lambda x: x is not None and bool(rx.match(str(x))))
+
+    def order(self, col, desc=False, nullsfirst=None, foreign_table=None):
+        if foreign_table: self.sub_orders[foreign_table] = (col, desc)
+        else: self.orders.append((col, desc, nullsfirst))
+        return self
+
+    def limit(self, n, foreign_table=None):
+        if foreign_table: self.sub_limits[foreign_table] = (0, n)
+        else: self.lim = n
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        if foreign_table: self.sub_limits[foreign_table] = (start, end - start + 1)
+        else: self.rng = (start, end)
+        return self
+
+    # --- execution ---
+    def _match(self, row, embedded):
+        for col, fn in self.filters:
+            if "." in col:
+                et, ec = col.split(".", 1)
+                e = embedded.get(et)
+                if e is None or not fn(e.get(ec)): return False
+            elif not fn(row.get(col)): return False
+        return True
+
+    def _embed(self, rows, table, embeds):
+        out = {}
+        for name, inner, (cols, sub) in embeds:
+            fk = f"{_singular(name)}_id"
+            if rows and fk in rows[0] or PARENTS.get(fk) == name:
+                idx = {r["id"]: r for r in self.c.tables.get(name, [])}
+                out[name] = ("one", inner, cols, sub, lambda r, idx=idx, fk=fk: idx.get(r.get(fk)))
+            else:
+                back = f"{_singular(table)}_id"
+                groups = {}
+                for r in self.c.tables.get(name, []): groups.setdefault(r.get(back), []).append(r)
+                out[name] = ("many", inner, cols, sub, lambda r, g=groups: g.get(r.get("id"), []))
+        return out
+
+    def _project(self, row, cols, embed_fns, table):
+        base = dict(row) if "*" in cols else {c: row.get(c) for c in cols}
+        for name, (kind, inner, ecols, esub, fn) in embed_fns.items():
+            val = fn(row)
+            sub_fns = self._embed([val] if kind == "one" and val else (val or []), name, esub) if esub else {}
+            if kind == "one":
+                base[name] = self._project(val, ecols, sub_fns, name) if val else None
+            else:
+                items = list(val)
+                if name in self.sub_orders:
+                    c, d = self.sub_orders[name]; items.sort(key=lambda r: _cmp_key(r.get(c)), reverse=d)
+                if name in self.sub_limits:
+                    s, n = self.sub_limits[name]; items = items[s:s + n]
+                base[name] = [self._project(v, ecols, sub_fns, name) for v in items]
+        return base
+
+    def execute(self):
+        t0 = time.perf_counter()
+        with self.c.lock:
+            res = getattr(self, f"_exec_{self.op}")()
+        self.c.log.append({"table": self.t, "op": self.op, "ms": (time.perf_counter() - t0) * 1000, "rows": len(res.data)})
+        return res
+
+    def _rows(self):
+        return self.c.tables.setdefault(self.t, [])
+
+    def _exec_select(self):
+        cols, embeds = _parse_select(self.sel)
+        rows = self._rows()
+        fns = self._embed(rows, self.t, embeds)
+        matched = []
+        for r in rows:
+            emb = {}
+            for name, (kind, inner, *_rest) in fns.items():
+                v = _rest[-1](r)
+                if inner and not v: break
+                emb[name] = v if kind == "one" else None
+            else:
+                if self._match(r, emb): matched.append(r)
+        for c, d, nf in reversed(self.orders):
+            # Как в Postgres: NULL последними при ASC и первыми при DESC, если не указано иное
+            nulls_first = d if nf is None else nf
+            nn = [r for r in matched if r.get(c) is not None]; nulls = [r for r in matched if r.get(c) is None]
+            nn.sort(key=lambda r: r.get(c), reverse=d)
+            matched = nulls + nn if nulls_first else nn + nulls
+        total = len(matched)
+        if self.rng: matched = matched[self.rng[0]:self.rng[1] + 1]
+        if self.lim is not None: matched = matched[:self.lim]
+        data = [copy.deepcopy(self._project(r, cols, fns, self.t)) for r in matched]
+        return SimpleNamespace(data=data, count=total if self.count else None)
+
+    def _stamp(self, row):
+        row["updated_at"] = datetime.now().isoformat()
+        return row
+
+    def _exec_insert(self):
+        items = self.payload if isinstance(self.payload, list) else [self.payload]
+        out = []
+        for it in items:
+            row = self._stamp(dict(it)); row["id"] = self.c.next_id(self.t)
+            self._rows().append(row); out.append(copy.deepcopy(row))
+            self.c.changes.append((self.t, "INSERT", copy.deepcopy(row)))
+        return SimpleNamespace(data=out, count=None)
+
+    def _exec_upsert(self):
+        items = self.payload if isinstance(self.payload, list) else [self.payload]
+        key = self.on_conflict
+        idx = {r.get(key): r for r in self._rows()}
+        keys = set().union(*[set(i) for i in items]) if items else set()
+        out = []
+        for it in items:
+            it = dict(it)
+            if self.upsert_defaults_null:
+                for k in keys: it.setdefault(k, None)
+            cur = idx.get(it.get(key))
+            if cur is not None:
+                cur.update(it); self._stamp(cur); out.append(copy.deepcopy(cur))
+                self.c.changes.append((self.t, "UPDATE", copy.deepcopy(cur)))
+            else:
+                if it.get("id") is None: it["id"] = self.c.next_id(self.t)
+                row = self._stamp(it); self._rows().append(row); idx[row.get(key)] = row; out.append(copy.deepcopy(row))
+                self.c.changes.append((self.t, "INSERT", copy.deepcopy(row)))
+        return SimpleNamespace(data=out, count=None)
+
+    def _exec_update(self):
+        out = []
+        for r in self._rows():
+            if self._match(r, {}):
+                r.update(self.payload); self._stamp(r); out.append(copy.deepcopy(r))
+                self.c.changes.append((self.t, "UPDATE", copy.deepcopy(r)))
+        return SimpleNamespace(data=out, count=None)
+
+    def _exec_delete(self):
+        keep, out = [], []
+        for r in self._rows():
+            if self._match(r, {}):
+                out.append(r); self.c.changes.append((self.t, "DELETE", {"id": r["id"]}))
+            else: keep.append(r)
+        self.c.tables[self.t] = keep
+        return SimpleNamespace(data=out, count=None)
+
+
+class FakeClient:
+    """Клиент-заглушка с тем же интерфейсом, что и supabase.Client"""
+
+    def __init__(self, tables=None):
+        self.tables = {k: list(v) for k, v in (tables or {}).items()}
+        self.lock = threading.RLock()
+        self.log, self.changes = [], []
+        self._ids = {t: max((r["id"] for r in rows), default=0) for t, rows in self.tables.items()}
+
+    def next_id(self, t):
+        self._ids[t] = self._ids.get(t, 0) + 1
+        return self._ids[t]
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    from_ = table
+
+    def reset_log(self):
+        self.log.clear()
+
+
+_shared = None
+
+
+def shared_client():
+    """Один клиент на процесс (данные из FAKE_DB_SIZE / FAKE_DB_SEED)"""
+    global _shared
+    if _shared is None:
+        sizes = [int(x) for x in os.environ.get("FAKE_DB_SIZE", "10000,50000,30000,20000").split(",")]
+        _shared = FakeClient(generate(*sizes, seed=int(os.environ.get("FAKE_DB_SEED", "0"))))
+    return _shared
+
+
+# --- DATA GENERATOR ---
+STATUSES = ["Prospection", "Qualification", "Echantillon", "Test R&D", "Essai industriel", "Négociation", "Client signé"]
+PRODUCTS = ["LENGOOD® (Substitut Œuf)", "PEPTIPEA® (Protéine)", "NEWGOOD® (Nouveauté)"]
+SEGMENTS = ["Boulangerie", "Sauces", "Confiserie", "Plats cuisinés", "Boissons"]
+COUNTRIES = ["France", "Allemagne", "Espagne", "Italie", "Belgique", "Pays-Bas", "Pologne", "Suisse"]
+SALONS = ["SIAL Paris", "Food Ingredients Europe", "Anuga", "IFT First", None]
+ROLES = ["Acheteur", "R&D Manager", "Directeur Technique", "Qualité", "CEO"]
+FIRST = ["Léa", "Hugo", "Chloé", "Lucas", "Inès", "Jules", "Zoé", "Louis", "Anaïs", "Émile", "Sofia", "Jonas"]
+LAST = ["Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Müller", "García", "Rossi", "Lefèvre"]
+WORDS = ["Boulang", "Nutri", "Agro", "Gourmet", "Délice", "Vital", "Pâtiss", "Green", "Terra", "Nova", "Fresh", "Bio"]
+SUFFIX = ["SAS", "GmbH", "SA", "Foods", "Industries", "& Co", "SpA", "BV"]
+
+
+def generate(n_prospects=10_000, n_samples=50_000, n_contacts=30_000, n_activities=20_000, seed=0):
+    """Синтетический набор данных для бенчмарков"""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    day = lambda: (now - timedelta(days=rnd.randint(0, 400))).isoformat()
+    prospects = [{
+        "id": i, "company_name": f"{rnd.choice(WORDS)}{rnd.choice(WORDS).lower()} {rnd.choice(SUFFIX)} {i}",
+        "status": rnd.choice(STATUSES), "country": rnd.choice(COUNTRIES), "product_interest": rnd.choice(PRODUCTS),
+        "segment": rnd.choice(SEGMENTS), "potential_volume": float(rnd.randint(0, 500)), "website_url": "",
+        "last_action_date": day(), "last_salon": rnd.choice(SALONS),
+        "notes": "Problématique " * rnd.randint(5, 40), "tech_notes": "Note R&D " * rnd.randint(5, 40), "updated_at": day(),
+    } for i in range(1, n_prospects + 1)]
+    samples = [{
+        "id": i, "prospect_id": rnd.randint(1, n_prospects), "reference": f"LOT-{i:06d}", "product_name": rnd.choice(PRODUCTS),
+        "status": rnd.choice(["En test", "Validé", "Rejeté", "Perdu"]), "date_sent": day(),
+        "feedback": rnd.choice([None, None, "RAS", "Texture OK, goût à revoir"]), "updated_at": day(),
+    } for i in range(1, n_samples + 1)]
+    contacts = []
+    for i in range(1, n_contacts + 1):
+        f, l = rnd.choice(FIRST), rnd.choice(LAST)
+        contacts.append({"id": i, "prospect_id": rnd.randint(1, n_prospects), "name": f"{f} {l}", "role": rnd.choice(ROLES),
+                         "email": f"{f.lower()}.{l.lower()}@example.com", "phone": f"+33 6 {rnd.randint(10, 99)} {rnd.randint(10, 99)} {rnd.randint(10, 99)} {rnd.randint(10, 99)}",
+                         "updated_at": day()})
+    activities = [{"id": i, "prospect_id": rnd.randint(1, n_prospects), "type": "Note", "content": "Appel de suivi " * rnd.randint(1, 8),
+                   "date": day(), "updated_at": day()} for i in range(1, n_activities + 1)]
+    return {"prospects": prospects, "samples": samples, "contacts": contacts, "activities": activities}
@@ -5,8 +5,22 @@ import google.generativeai as genai
 import plotly.express as px
 from datetime import datetime, timedelta
 import io
+import tempfile
+import xlsxwriter
 import numpy as np
 import time
+import threading
+import asyncio
+import functools
+import json
+from collections import deque
+from contextlib import contextmanager
+import random
+import os
+import re
+import bisect
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 1. CONFIGURATION & STYLES ---
 st.set_page_config(page_title="Ingood Growth AI", page_icon="🧬", layout="wide")
@@ -36,15 +50,6 @@ st.markdown("""
         }
         .filter-label-white { color: #ffffff !important; font-weight: 700; font-size: 14px; }
 
-        /* Шапка таблицы Pipeline */
-        .pipeline-header-row {
-            padding: 12px 15px 8px 15px; margin-bottom: 5px; display: flex; align-items: center;
-        }
-        .header-text-style { 
-            color: #047857 !important; font-size: 14px !important; font-weight: 800 !important; 
-            text-transform: uppercase; letter-spacing: 0.5px;
-        }
-
         /* Стиль строк Pipeline */
         div[data-testid="stVerticalBlockBorderWrapper"] {
             background-color: #ffffff !important; border: none !important;
@@ -93,15 +98,126 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# --- 1.1 PERF INSTRUMENTATION ---
+# Замеры на процесс: запросы Supabase (время, строки, байты), секции рендера, попадания в кэш,
+# проглоченные исключения и сводка по каждому перезапуску скрипта. Всё это показывает страница Perf.
+@st.cache_resource
+def _perf_store():
+    """Кольцевые буферы замеров, общие для всех сессий"""
+    return {"lock": threading.Lock(), "queries": deque(maxlen=5000), "sections": deque(maxlen=5000),
+            "runs": deque(maxlen=1000), "errors": deque(maxlen=200), "cache": {}, "ctx": threading.local()}
+
+# Контекст потока держим в кэше ресурса: закэшированный клиент живет дольше глобалов одного перезапуска
+_perf_ctx = _perf_store()["ctx"]
+
+def perf_begin():
+    _perf_ctx.run = {"ts": datetime.now(), "t0": time.perf_counter(), "queries": 0, "db_ms": 0.0, "rows": 0, "bytes": 0, "hits": 0, "misses": 0, "errors": 0}
+
+def perf_end(page):
+    """Закрывает сводку перезапуска (st.rerun/st.stop до этой точки не доходят)"""
+    run = getattr(_perf_ctx, "run", None)
+    if run is None: return
+    _perf_ctx.run = None
+    run.update(page=page, ms=(time.perf_counter() - run.pop("t0")) * 1000)
+    _perf_store()["runs"].append(run)
+
+def _perf_count(key, n=1):
+    run = getattr(_perf_store()["ctx"], "run", None)
+    if run is not None: run[key] += n
+
+@contextmanager
+def perf_section(name):
+    """Время рендера секции страницы"""
+    t0 = time.perf_counter()
+    try: yield
+    finally: _perf_store()["sections"].append({"ts": datetime.now(), "section": name, "ms": (time.perf_counter() - t0) * 1000})
+
+def perf_swallow(where, e, fallback=None):
+    """Фиксирует перехваченное исключение и возвращает запасное значение"""
+    _perf_store()["errors"].append({"ts": datetime.now(), "where": where, "error": f"{type(e).__name__}: {e}"})
+    _perf_count("errors")
+    return fallback
+
+def tracked_cache(resource=False, **kw):
+    """st.cache_data (или st.cache_resource) со счетчиком вызовов и промахов кэша"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def body(*a, **k):
+            _perf_ctx.miss = True  # тело выполняется только при промахе
+            return fn(*a, **k)
+        cached = (st.cache_resource if resource else st.cache_data)(**kw)(body)
+        @functools.wraps(fn)
+        def call(*a, **k):
+            prev, _perf_ctx.miss = getattr(_perf_ctx, "miss", False), False
+            try: return cached(*a, **k)
+            finally:
+                miss, _perf_ctx.miss = _perf_ctx.miss, prev
+                store = _perf_store()
+                with store["lock"]:
+                    c = store["cache"].setdefault(fn.__name__, [0, 0]); c[0] += 1; c[1] += miss
+                _perf_count("misses" if miss else "hits")
+        call.clear = cached.clear
+        return call
+    return deco
+
+def _perf_arg(name, a):
+    if not a: return ""
+    if name == "select": return str(a[0])[:60]
+    if name in ("insert", "upsert"): return f"{len(a[0]) if isinstance(a[0], list) else 1} rows"
+    if name in ("update", "range", "limit"): return "…"
+    return str(a[0])
+
+class _TracedQuery:
+    """Прокси цепочки запроса: запоминает форму запроса (без значений) и замеряет execute()"""
+    def __init__(self, store, t, q):
+        self.store, self.t, self.q, self.shape = store, t, q, []
+
+    def __getattr__(self, name):
+        attr = getattr(self.q, name)
+        def chain(*a, **k):
+            self.q = attr(*a, **k); self.shape.append(f"{name}({_perf_arg(name, a)})"); return self
+        return chain
+
+    def execute(self):
+        t0, data, err = time.perf_counter(), None, None
+        try:
+            res = self.q.execute(); data = res.data; return res
+        except Exception as e:
+            err = e; raise
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            rows = len(data) if isinstance(data, list) else int(data is not None)
+            size = len(json.dumps(data, default=str)) if data else 0
+            self.store["queries"].append({"ts": datetime.now(), "table": self.t, "query": f"{self.t}." + ".".join(self.shape),
+                                          "ms": ms, "rows": rows, "bytes": size, "ok": err is None})
+            _perf_count("queries"); _perf_count("db_ms", ms); _perf_count("rows", rows); _perf_count("bytes", size)
+
+class InstrumentedClient:
+    """Клиент Supabase с замером каждого запроса table(...)...execute()"""
+    def __init__(self, client, store):
+        self.client, self.store = client, store
+
+    def table(self, t):
+        return _TracedQuery(self.store, t, self.client.table(t))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+perf_begin()
+
 # --- 2. CONNECTIONS ---
 @st.cache_resource
 def init_connections():
     try:
+        if os.environ.get("INGOOD_FAKE_DB"):
+            # Локальная база в памяти (fake_supabase.py) вместо Supabase
+            from fake_supabase import shared_client
+            return InstrumentedClient(shared_client(), _perf_store())
         url = st.secrets["SUPABASE_URL"]
         key = st.secrets["SUPABASE_KEY"]
         # Инициализация Gemini API
         genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-        return create_client(url, key)
+        return InstrumentedClient(create_client(url, key), _perf_store())
     except Exception as e:
         st.error(f"Erreur de connexion Supabase: {e}")
         return None
@@ -109,15 +225,26 @@ def init_connections():
 supabase = init_connections()
 if not supabase: st.stop()
 
+def setting(key, default=None):
+    """Необязательная настройка из st.secrets (без secrets.toml — значение по умолчанию)"""
+    try: return st.secrets.get(key, default)
+    except FileNotFoundError: return default
+
 # --- 3. AI CORE (ROBUST FIX) ---
-def ai_generate_smart_email(company, product, tone, country):
-    """Генерация письма с актуальными моделями Gemini 1.5"""
-    
-    # Используем flash как основную (быстрая и дешевая)
-    # Имя модели пишем БЕЗ префикса 'models/', если используем genai.GenerativeModel напрямую
-    primary_model_name = "gemini-1.5-flash" 
-    
-    prompt = f"""
+# Цепочка моделей: flash с Google Search -> flash без инструментов -> pro.
+# Клиенты моделей переиспользуются, упавший уровень пропускается AI_TIER_COOLDOWN секунд,
+# готовые письма кэшируются на AI_CACHE_TTL по (компания, продукт, тон, страна), не более AI_CACHE_MAX штук.
+AI_TIERS = [("gemini-1.5-flash", True), ("gemini-1.5-flash", False), ("gemini-1.5-pro", False)]
+AI_TIER_COOLDOWN = 600
+AI_CACHE_TTL = 3600
+AI_CACHE_MAX = 500  # писем в кэше; при переполнении сначала уходят просроченные, затем самые старые
+AI_RESET = object()  # маркер потока: уровень упал посреди ответа, уже полученный текст нужно сбросить
+
+class AIUnavailable(Exception):
+    """Все уровни цепочки моделей недоступны"""
+
+def _email_prompt(company, product, tone, country):
+    return f"""
     Rôle : Manager commercial technique pour Ingood Growth. 
     Cible : {company} ({country}). Produit : {product}. Ton : {tone}.
     Instructions : 
@@ -125,42 +252,192 @@ def ai_generate_smart_email(company, product, tone, country):
     2. Используй профессиональный стиль.
     3. Свяжи их активность с преимуществами продукта {product}.
     """
-    
-    try:
-        # Пытаемся вызвать модель с инструментом Google Search
-        # В актуальной версии API инструмент называется 'google_search_retrieval'
-        model = genai.GenerativeModel(
-            model_name=primary_model_name,
-            tools=[{"google_search_retrieval": {}}] 
-        )
-        response = model.generate_content(prompt)
-        return response.text
 
-    except Exception as e:
-        # Fallback 1: Если поиск не поддерживается или произошла ошибка, пробуем без инструментов
+def _new_ai_model(name, grounded):
+    """Клиент Gemini; INGOOD_FAKE_AI=1 подменяет его локальной заглушкой (fake_gemini.py)"""
+    if os.environ.get("INGOOD_FAKE_AI"): from fake_gemini import FakeGenerativeModel as Model
+    else: Model = genai.GenerativeModel
+    # В актуальной версии API инструмент поиска называется 'google_search_retrieval'
+    return Model(model_name=name, tools=[{"google_search_retrieval": {}}] if grounded else None)
+
+@st.cache_resource
+def _ai_state():
+    """Общее для процесса состояние AI: клиенты моделей, время последнего сбоя уровня, кэш ответов
+    и лимит вызовов моделей в минуту (квота одна на ключ API)"""
+    return {"lock": threading.Lock(), "models": {}, "failed": {}, "cache": {}, "rate": RateLimiter(int(setting("AI_RPM", AI_RPM)))}
+
+def _ai_cache_put(state, key, text):
+    with state["lock"]:
+        cache, now = state["cache"], time.time()
+        cache.pop(key, None); cache[key] = (now, text)  # dict хранит порядок вставки: первые — самые старые
+        if len(cache) > AI_CACHE_MAX:
+            for k in [k for k, (t, _) in cache.items() if now - t >= AI_CACHE_TTL]: del cache[k]
+            for k in list(cache)[:len(cache) - AI_CACHE_MAX]: del cache[k]
+
+def ai_stream_email(company, product, tone, country, state):
+    """Генератор фрагментов письма. Можно вызывать вне потока скрипта: состояние передается явно"""
+    key = (company, product, tone, country)
+    hit = state["cache"].get(key)
+    if hit and time.time() - hit[0] < AI_CACHE_TTL:
+        yield hit[1]; return
+    prompt, err = _email_prompt(company, product, tone, country), None
+    tiers = [t for t in AI_TIERS if time.time() - state["failed"].get(t, 0) > AI_TIER_COOLDOWN] or AI_TIERS[-1:]
+    for tier in tiers:
+        parts = []
         try:
-            model_basic = genai.GenerativeModel(model_name=primary_model_name)
-            response = model_basic.generate_content(prompt)
-            return response.text
-        except Exception as e2:
-            # Fallback 2: Последняя попытка с моделью Pro (если Flash недоступна)
+            with state["lock"]:
+                model = state["models"].get(tier) or state["models"].setdefault(tier, _new_ai_model(*tier))
+            state["rate"].acquire()  # каждый вызов модели, в том числе переход на следующий уровень
+            for chunk in model.generate_content(prompt, stream=True):
+                parts.append(chunk.text); yield chunk.text
+            state["failed"].pop(tier, None)
+            _ai_cache_put(state, key, "".join(parts))
+            return
+        except Exception as e:
+            # Уровень запоминается как упавший: следующие вызовы сразу начинают со следующего
+            state["failed"][tier] = time.time(); err = e
+            if parts: yield AI_RESET
+    raise AIUnavailable(str(err))
+
+def _ai_complete(company, product, tone, country, state):
+    """Полный текст письма; AIUnavailable, если ни один уровень не ответил"""
+    out = []
+    for part in ai_stream_email(company, product, tone, country, state):
+        if part is AI_RESET: out.clear()
+        else: out.append(part)
+    return "".join(out)
+
+def start_ai_job(company, product, tone, country):
+    """Запускает генерацию в фоновом потоке; фрагменты копятся в job['chunks']"""
+    job, state = {"chunks": [], "done": False}, _ai_state()
+    def run():
+        try:
+            for part in ai_stream_email(company, product, tone, country, state):
+                if part is AI_RESET: job["chunks"].clear()
+                else: job["chunks"].append(part)
+        except AIUnavailable as e: job["chunks"][:] = [f"Désolé, le service AI est indisponible. Техническая ошибка: {e}"]
+        finally: job["done"] = True
+    _bg_pool().submit(run)
+    return job
+
+@st.fragment(run_every=0.5)
+def ai_draft_stream():
+    """Опрос фоновой генерации: текст появляется по мере поступления, по завершении — обычный черновик"""
+    job = st.session_state.get('ai_job')
+    if job is None: return
+    txt = "".join(job["chunks"])
+    if job["done"]:
+        st.session_state['ai_draft'] = txt; del st.session_state['ai_job']; st.rerun()
+    st.caption("✨ Rédaction en cours...")
+    st.text_area("Brouillon AI Research", value=txt, height=200, disabled=True)
+
+# --- 3.1 AI BULK DRAFTS ---
+# Пакетная подготовка писем (после салонов): ограниченный пул потоков, общий лимит вызовов моделей в минуту
+# (state["rate"], берется перед каждым вызовом внутри цепочки уровней),
+# повторы с экспоненциальной паузой. Черновики сохраняются как activities типа DRAFT_TYPE, поэтому
+# повторный запуск той же выборки (в том числе после перезапуска сервера) пропускает уже готовые.
+AI_BULK_WORKERS = 4
+AI_BULK_RETRIES = 3
+AI_RPM = 15
+DRAFT_TYPE = "Brouillon AI"
+
+class RateLimiter:
+    """Равномерный лимит вызовов в минуту, общий для всех потоков"""
+    def __init__(self, per_minute):
+        self.interval, self.lock, self.next = 60.0 / per_minute, threading.Lock(), 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic(); at = max(now, self.next); self.next = at + self.interval
+        time.sleep(max(0.0, at - now))
+
+def _drafted_recently(ids, since):
+    """id проспектов, у которых уже есть черновик AI не старше since"""
+    done = set()
+    for i in range(0, len(ids), 200):
+        rows = supabase.table("activities").select("prospect_id").eq("type", DRAFT_TYPE).gte("date", since).in_("prospect_id", ids[i:i + 200]).execute().data
+        done.update(r["prospect_id"] for r in rows)
+    return done
+
+def start_bulk_drafts(targets, tone, skip_days):
+    """Запускает пакетную генерацию по списку проспектов (dict: id, company_name, product_interest, country)"""
+    state, vs = _ai_state(), _data_versions()
+    job = {"total": len(targets), "todo": None, "skipped": 0, "done": 0, "failed": 0, "errors": [], "cancel": False, "finished": False}
+    lock = threading.Lock()
+
+    def worker(row):
+        err = None
+        for attempt in range(AI_BULK_RETRIES):
+            if job["cancel"]: return
             try:
-                model_pro = genai.GenerativeModel(model_name="gemini-1.5-pro")
-                return model_pro.generate_content(prompt).text
-            except Exception as final_e:
-                return f"Désolé, le service AI est indisponible. Техническая ошибка: {str(final_e)}"
+                text = _ai_complete(row["company_name"], row.get("product_interest"), tone, row.get("country"), state)
+                supabase.table("activities").insert({"prospect_id": row["id"], "type": DRAFT_TYPE, "content": text, "date": datetime.now().isoformat()}).execute()
+                touch("activities", row["id"], vs=vs)
+                with lock: job["done"] += 1
+                return
+            except Exception as e:
+                err = e; time.sleep(min(60.0, 2 ** attempt + random.random()))
+        with lock: job["failed"] += 1; job["errors"].append(f"{row['company_name']}: {err}")
+
+    def run():
+        try:
+            since = (datetime.now() - timedelta(days=skip_days)).isoformat()
+            done = _drafted_recently([int(t["id"]) for t in targets], since) if skip_days else set()
+            todo = [t for t in targets if t["id"] not in done]
+            job["skipped"], job["todo"] = len(targets) - len(todo), len(todo)
+            with ThreadPoolExecutor(max_workers=AI_BULK_WORKERS) as pool: list(pool.map(worker, todo))
+        except Exception as e: job["errors"].append(str(e))
+        finally: job["finished"] = True
+
+    threading.Thread(target=run, daemon=True).start()
+    return job
+
+@st.fragment(run_every=1)
+def bulk_drafts_progress(key):
+    """Прогресс пакетной генерации; по завершении — полный перезапуск для итогов"""
+    job = st.session_state.get(key)
+    if job is None: return
+    if job["finished"]: st.rerun()
+    if job["todo"] is None: st.caption("Préparation de la sélection..."); return
+    n = job["done"] + job["failed"]
+    st.progress(n / job["todo"] if job["todo"] else 1.0, text=f"{n}/{job['todo']} brouillons • {job['skipped']} déjà prêts • {job['failed']} échecs")
+    if st.button("⏹ Arrêter", key=f"{key}_stop"): job["cancel"] = True
+
+def render_bulk_drafts(key, label, load_targets):
+    """Блок пакетных черновиков AI; load_targets() вызывается только при запуске"""
+    key = f"bulk_job_{key}"
+    with st.expander(f"✨ Brouillons AI en masse — {label}"):
+        job = st.session_state.get(key)
+        if job and not job["finished"]: bulk_drafts_progress(key); return
+        if job:
+            st.success(f"{job['done']} brouillon(s) enregistré(s) dans le Journal • {job['skipped']} déjà prêt(s) • {job['failed']} échec(s)")
+            for e in job["errors"][:10]: st.caption(f"⚠️ {e}")
+        b1, b2, b3 = st.columns([1.5, 1.5, 1])
+        with b1: tone = st.selectbox("Ton", ["Professionnel", "Relance amicale", "Urgent / Technique"], key=f"{key}_tone")
+        with b2: skip_days = st.number_input("Ignorer si brouillon de moins de (jours)", 0, 90, 7, key=f"{key}_skip")
+        with b3:
+            st.write("")
+            if st.button("Lancer", type="primary", key=f"{key}_go", use_container_width=True):
+                st.session_state[key] = start_bulk_drafts(load_targets(), tone, skip_days); st.rerun()
 
 # --- 4. DATA HELPERS ---
+# Справочники карточки проспекта (используются и при импорте)
+STATUS_OPTS = ["Prospection", "Qualification", "Echantillon", "Test R&D", "Essai industriel", "Négociation", "Client signé"]
+PRODUCT_OPTS = ["LENGOOD® (Substitut Œuf)", "PEPTIPEA® (Protéine)", "NEWGOOD® (Nouveauté)"]
+SEGMENT_OPTS = ["Boulangerie", "Sauces", "Confiserie", "Plats cuisinés", "Boissons"]
+
 if 'pipeline_key' not in st.session_state: st.session_state['pipeline_key'] = 0
 
 def reset_pipeline(): 
-    """Сброс состояния для обновления всех таблиц и диалогов"""
+    """Сброс состояния для обновления всех таблиц и диалогов (кэш данных инвалидируется точечно через touch)"""
     st.session_state['pipeline_key'] += 1
-    st.cache_data.clear()
     safe_del('active_prospect_id')
     safe_del('ai_draft')
+    safe_del('ai_job')
     if 'editing_contacts' in st.session_state: del st.session_state['editing_contacts']
     if 'contacts_to_delete' in st.session_state: del st.session_state['contacts_to_delete']
+    safe_del('contacts_loaded')
+    for k in [k for k in st.session_state if str(k).startswith('journal_p_')]: safe_del(k)
 
 def safe_del(key): 
     if key in st.session_state: del st.session_state[key]
@@ -170,33 +447,806 @@ def clean_prod_name(name):
     if not name or name == "-" or str(name) == "nan": return "-"
     return str(name).split(' (')[0].split('(')[0].strip()
 
-@st.cache_data(ttl=60)
+# --- 4.1 DATA ACCESS: ВЕРСИИ И ТОЧЕЧНАЯ ИНВАЛИДАЦИЯ ---
+# Каждая кэшируемая выборка получает номер версии своей таблицы (или пары таблица+проспект) как аргумент.
+# Запись увеличивает только затронутые счетчики: старые записи кэша просто перестают запрашиваться,
+# а кэш остальных таблиц и проспектов переживает правку и остается общим для всех сессий.
+@st.cache_resource
+def _data_versions():
+    """Счетчики версий, общие для всех сессий процесса"""
+    return {"lock": threading.Lock(), "v": {}}
+
+def data_version(t, pid=None):
+    return _data_versions()["v"].get((t, None if pid is None else int(pid)), 0)
+
+def touch(t, *pids, vs=None):
+    """Инвалидация таблицы t и (опционально) данных конкретных проспектов.
+    Из фоновых потоков передается vs=_data_versions(), полученный в потоке скрипта"""
+    vs = vs or _data_versions()
+    with vs["lock"]:
+        for k in [(t, None)] + [(t, int(p)) for p in set(pids) if p is not None]:
+            vs["v"][k] = vs["v"].get(k, 0) + 1
+
+class db_write:
+    """Обертка над supabase.table(t) для записей: после execute() увеличивает версии затронутых данных.
+    Проспекты определяются по возвращенным строкам (id для prospects, prospect_id для дочерних таблиц)"""
+    def __init__(self, t, pid=None):
+        self.t, self.pid, self.q, self.kind = t, pid, supabase.table(t), "UPDATE"
+
+    def __getattr__(self, name):
+        attr = getattr(self.q, name)
+        def chain(*a, **k):
+            if name == "delete": self.kind = "DELETE"
+            self.q = attr(*a, **k); return self
+        return chain
+
+    def execute(self):
+        res = self.q.execute()
+        live_store().apply([(self.t, self.kind, r) for r in res.data or []], silent=True)  # сразу видно всем сессиям
+        key = "id" if self.t == "prospects" else "prospect_id"
+        touch(self.t, self.pid, *[r.get(key) for r in (res.data or [])])
+        return res
+
+def fetch_pages(make_query, size=1000):
+    """Постраничная выборка через .range(): make_query() должен каждый раз строить новый запрос"""
+    start = 0
+    while True:
+        rows = make_query().range(start, start + size - 1).execute().data or []
+        if rows: yield rows
+        if len(rows) < size: return
+        start += size
+
 def get_data(): 
-    """Основной запрос списка проспектов"""
+    """Список проспектов из live-store (копия: страницы могут менять кадр)"""
+    return live_frame("prospects").copy()
+
+JOURNAL_PAGE = 20  # записей журнала за одну подгрузку
+CARD_TABLES = ("prospects", "contacts", "samples", "activities")
+
+@tracked_cache(ttl=600, max_entries=200)
+def _fetch_card(pid, v):
+    """Карточка одним запросом: проспект + контакты, образцы и первая страница журнала"""
     try:
-        res = supabase.table("prospects").select("*").order("last_action_date", desc=True).execute()
-        return pd.DataFrame(res.data)
-    except: return pd.DataFrame()
+        d = (supabase.table("prospects").select("*, contacts(*), samples(*), activities(*)").eq("id", pid)
+             .order("id", desc=True, foreign_table="contacts").order("id", desc=True, foreign_table="samples")
+             .order("id", desc=True, foreign_table="activities").range(0, JOURNAL_PAGE, foreign_table="activities").execute().data)
+        if not d: return None
+        p = d[0]; subs = {t: p.pop(t) or [] for t in CARD_TABLES[1:]}
+        # Лишняя (JOURNAL_PAGE+1)-я запись только показывает, что журнал длиннее первой страницы
+        return {"prospect": p, **subs, "activities": subs["activities"][:JOURNAL_PAGE], "more": len(subs["activities"]) > JOURNAL_PAGE}
+    except Exception as e: return perf_swallow("card", e, None)
+
+def get_card(pid):
+    """Данные карточки (кэш на версии проспекта и его контактов, образцов и журнала)"""
+    return _fetch_card(int(pid), tuple(data_version(t, pid) for t in CARD_TABLES))
 
-def get_sub_data(t, pid):
-    """Загрузка контактов или образцов для конкретной компании"""
+@tracked_cache(ttl=60, max_entries=8)
+def _fetch_filter_options(v):
     try:
-        d = supabase.table(t).select("*").eq("prospect_id", pid).order("id", desc=True).execute().data
-        return pd.DataFrame(d)
-    except: return pd.DataFrame()
+        f = live_frame("prospects")  # все строки, а не первые max_rows одиночного select
+        if f.empty: return [], []
+        return sorted(f['product_interest'].dropna().astype(str).unique()), sorted(f['country'].dropna().astype(str).unique())
+    except Exception as e: return perf_swallow("filter_options", e, ([], []))
+
+def get_filter_options():
+    """Списки значений для фильтров Pipeline (только две колонки, без полной таблицы)"""
+    return _fetch_filter_options(data_version("prospects"))
+
+def pipeline_filters(q, p_f, s_f, py_f, prefix=""):
+    """Фильтры Pipeline для запроса к prospects (prefix="prospects." для встроенной таблицы)"""
+    if p_f: q = q.eq(f"{prefix}product_interest", p_f)
+    if s_f: q = q.ilike(f"{prefix}status", f"%{s_f}%")
+    if py_f: q = q.eq(f"{prefix}country", py_f)
+    return q
+
+PIPELINE_COLS = "id, company_name, country, product_interest, status, last_action_date, last_salon"  # только колонки таблицы Pipeline
+
+@tracked_cache(ttl=60, max_entries=200)
+def _fetch_pipeline_page(p_f, s_f, py_f, page, size, v):
+    try:
+        q = pipeline_filters(supabase.table("prospects").select(PIPELINE_COLS, count="exact"), p_f, s_f, py_f)
+        start = (page - 1) * size
+        # id — уникальный второй ключ: при равных (или NULL) датах строки не кочуют между страницами
+        res = q.order("last_action_date", desc=True).order("id", desc=True).range(start, start + size - 1).execute()
+        return pd.DataFrame(res.data), res.count or 0
+    except Exception as e: return perf_swallow("pipeline_page", e, (pd.DataFrame(), 0))
+
+def get_pipeline_page(p_f, s_f, py_f, page, size):
+    """Страница Pipeline: фильтры и пагинация выполняются на стороне Supabase"""
+    return _fetch_pipeline_page(p_f, s_f, py_f, page, size, data_version("prospects"))
+
+def get_draft_targets(p_f=None, s_f=None, py_f=None, ids=None):
+    """Проспекты для пакетных черновиков AI: вся выборка по фильтрам Pipeline или по списку id"""
+    cols = "id, company_name, product_interest, country"
+    if ids is not None:
+        ids = sorted({int(i) for i in ids})
+        return [r for i in range(0, len(ids), 200) for r in supabase.table("prospects").select(cols).in_("id", ids[i:i + 200]).execute().data]
+    return [r for page in fetch_pages(lambda: pipeline_filters(supabase.table("prospects").select(cols), p_f, s_f, py_f).order("id")) for r in page]
+
+@tracked_cache(max_entries=4)
+def _fetch_sample_stats(v):
+    try:
+        # Вся таблица из live-store: одиночный select PostgREST обрезается до max_rows (1000)
+        s = live_frame("samples")
+        if s.empty: return {}
+        s = s.sort_values('date_sent', ascending=False, na_position="last", kind="stable")
+        agg = s.groupby('prospect_id', sort=False).agg(n=('status', 'size'), status=('status', 'first'), last_sent=('date_sent', 'first'))
+        return agg.to_dict('index')
+    except Exception as e: return perf_swallow("sample_stats", e, {})
+
+def get_sample_stats():
+    """Агрегаты образцов по prospect_id за один проход: количество, последний статус и дата отправки.
+    Без TTL: пересчитывается только после записи в samples"""
+    return _fetch_sample_stats(data_version("samples"))
+
+@tracked_cache(ttl=600, max_entries=500)
+def _fetch_journal(pid, page, v):
+    try:
+        start = page * JOURNAL_PAGE
+        return supabase.table("activities").select("*").eq("prospect_id", pid).order("id", desc=True).range(start, start + JOURNAL_PAGE).execute().data
+    except Exception as e: return perf_swallow("journal", e, [])
+
+def get_journal(pid, page):
+    """Следующие страницы журнала (первая приходит вместе с карточкой); +1 запись — признак продолжения"""
+    return _fetch_journal(int(pid), page, data_version("activities", pid))
+
+def get_joined(t):
+    """Контакты или образцы с названием компании в колонке Client (из live-store)"""
+    df, p = live_frame(t), live_frame("prospects")
+    if df.empty: return df.copy()
+    names = p.set_index('id')['company_name'] if not p.empty else pd.Series(dtype=object)
+    return df.assign(Client=df['prospect_id'].map(names).fillna('-'))
+
+
+CONTACT_FIELDS = ("name", "role", "email", "phone")
+
+def sync_contacts(pid, contacts, loaded, to_delete):
+    """Синхронизация контактов карточки пакетно: один delete, один upsert измененных, один insert новых.
+    Контакты, не изменившиеся с момента загрузки (loaded: id -> исходная запись), не отправляются"""
+    changed, new = [], []
+    for rc in contacts:
+        if not str(rc.get("name") or "").strip(): continue
+        pl = {"prospect_id": pid, **{f: rc.get(f) or "" for f in CONTACT_FIELDS}}
+        if rc.get("id"):
+            old = loaded.get(int(rc["id"]))
+            if old is None or any((old.get(f) or "") != pl[f] for f in CONTACT_FIELDS): changed.append({**pl, "id": int(rc["id"])})
+        else: new.append(pl)
+    if to_delete: db_write("contacts", pid).delete().in_("id", to_delete).execute()
+    if changed: db_write("contacts", pid).upsert(changed).execute()
+    if new: db_write("contacts", pid).insert(new).execute()
+
+SAMPLE_FLUSH_DELAY = 3  # сек. без новых правок, после которых буфер образцов отправляется
+
+def queue_sample_edit(row, field, key):
+    """on_change статуса/фидбека образца: правка копится в буфере сессии (слияние по id) вместо немедленного update.
+    Хранятся только реально измененные поля — остальные не перетирают чужие более свежие правки"""
+    buf = st.session_state.setdefault('pending_samples', {})
+    ent = buf.setdefault(int(row['id']), {"id": int(row['id']), "prospect_id": int(row['prospect_id'])})
+    ent[field] = st.session_state[key]
+    st.session_state['pending_samples_at'] = time.time()
+
+def flush_sample_edits(force=False):
+    """Отправляет буфер правок образцов: один update на каждый набор одинаковых правок (in_ по id);
+    без force — только после паузы SAMPLE_FLUSH_DELAY. update, а не upsert: удаленный тем временем образец не воскресает"""
+    buf = st.session_state.get('pending_samples')
+    if not buf or (not force and time.time() - st.session_state.get('pending_samples_at', 0) < SAMPLE_FLUSH_DELAY): return
+    groups = {}
+    for e in buf.values():
+        groups.setdefault(tuple(sorted((f, v) for f, v in e.items() if f not in ("id", "prospect_id"))), []).append(e['id'])
+    try:
+        for upd, ids in groups.items():
+            db_write("samples").update(dict(upd)).in_("id", ids).execute()
+            for i in ids: buf.pop(i, None)
+        return True
+    except Exception as e: st.toast(f"Samples non enregistrés: {e}")
+
+@st.fragment(run_every=SAMPLE_FLUSH_DELAY)
+def sample_flush_timer(pid):
+    """Таймер буфера внутри карточки: правки в диалоге перезапускают только диалог, до общего rerun дело не доходит"""
+    if flush_sample_edits(): st.rerun()  # полный rerun — карточка перечитает образцы
+    mine = [v for v in st.session_state.get('pending_samples', {}).values() if v['prospect_id'] == pid]
+    if mine:
+        pw1, pw2 = st.columns([3, 1])
+        pw1.caption(f"⏳ {len(mine)} modification(s) en attente d'enregistrement")
+        if pw2.button("💾 Enregistrer", key=f"flush_s_{pid}"): flush_sample_edits(force=True); st.rerun()
 
-def count_relances():
-    """Счетчик уведомлений: образцы без фидбека дольше 15 дней"""
-    fifteen_days_ago = (datetime.now() - timedelta(days=15)).isoformat()
+def close_prospect_card():
+    """Закрытие карточки крестиком: дописываем буфер образцов и сбрасываем выбор, иначе карточка откроется снова"""
+    flush_sample_edits(force=True); reset_pipeline()
+
+KANBAN_COLUMN_LIMIT = 20  # карточек на колонку до "Afficher plus"
+
+@st.cache_resource
+def _bg_pool():
+    """Пул фоновых потоков для записей, которые не должны блокировать перерисовку"""
+    return ThreadPoolExecutor(max_workers=4)
+
+def move_prospect(pid, old_status, new_status):
+    """Оптимистичный перенос карточки: статус сразу подменяется в кэше сессии, update уходит в фоновый поток"""
+    pid, moves = int(pid), st.session_state.setdefault('kanban_moves', {})
+    if pid in moves: return  # предыдущий перенос еще в полете — второй update перетер бы его future
+    fut = _bg_pool().submit(supabase.table("prospects").update({"status": new_status}).eq("id", pid).execute)
+    moves[pid] = {"status": new_status, "prev": old_status, "fut": fut}
+
+@st.fragment(run_every=0.5)
+def kanban_moves_watch():
+    """Опрос фоновых переносов: как только update завершился, полный rerun снимает ⏳ (или откатывает карточку)"""
+    if any(m['fut'].done() for m in st.session_state.get('kanban_moves', {}).values()): st.rerun()
+
+def settle_kanban_moves():
+    """Разбор завершенных фоновых переносов: успех -> инвалидация версии проспекта, ошибка -> откат"""
+    moves = st.session_state.get('kanban_moves', {})
+    for pid, m in list(moves.items()):
+        if not m['fut'].done(): continue
+        del moves[pid]
+        if m['fut'].exception(): st.toast(f"↩︎ {m['prev']}: déplacement annulé ({m['fut'].exception()})")
+        else: live_store().apply([("prospects", "UPDATE", r) for r in m['fut'].result().data or []], silent=True); touch("prospects", pid)
+
+# --- 4.2 PIPELINE SNAPSHOTS (DASHBOARD) ---
+# Ежедневные агрегаты воронки. Ожидаемая схема Supabase:
+#   pipeline_snapshots(day date primary key, rollup jsonb)
+#   pipeline_snapshot_state(id int primary key, watermark timestamptz, n_members int, rollup jsonb)
+#   pipeline_snapshot_members(prospect_id bigint primary key, member jsonb)
+#   prospects.updated_at timestamptz, обновляемая триггером при каждом изменении строки.
+# rollup = {"total"|dim: {значение: [кол-во, тоннаж]}}, member = [status, product, segment, country, volume]:
+# старый вклад измененного проспекта читается и переписывается только для строк с updated_at >= watermark,
+# так что обновление среза не зависит от размера базы (кроме редкой сверки удалений).
+SNAPSHOT_DIMS = ("status", "product_interest", "segment", "country")
+SNAPSHOT_COLS = "id, updated_at, " + ", ".join(SNAPSHOT_DIMS) + ", potential_volume"
+
+def _snap_member(r):
+    return [r.get(d) or "-" for d in SNAPSHOT_DIMS] + [float(r.get("potential_volume") or 0)]
+
+def _snap_add(rollup, m, sign):
+    """Добавляет (sign=1) или вычитает (sign=-1) вклад одного проспекта"""
+    for dim, key in zip(("total",) + SNAPSHOT_DIMS, ["all"] + m[:-1]):
+        c = rollup.setdefault(dim, {}).setdefault(str(key), [0, 0.0])
+        c[0] += sign; c[1] += sign * m[-1]
+        if c[0] <= 0: del rollup[dim][str(key)]
+
+def _rollup_from_frame(df):
+    """Полный расчет агрегатов по таблице (резервный режим без таблиц срезов; сверка в тестах)"""
+    if df.empty: return {}
+    vol = pd.to_numeric(df['potential_volume'], errors='coerce').fillna(0)
+    out = {"total": {"all": [len(df), float(vol.sum())]}}
+    for d in SNAPSHOT_DIMS:
+        g = vol.groupby(df[d].astype(object).fillna("-").replace("", "-").astype(str)).agg(['size', 'sum'])
+        out[d] = {k: [int(n), float(t)] for k, (n, t) in g.iterrows()}
+    return out
+
+SNAPSHOT_CHUNK = 500  # id в одном in_() / строк в одном upsert
+
+def _snap_members(ids):
+    """Сохраненные вклады указанных проспектов"""
+    ids = sorted(ids)
+    return {r["prospect_id"]: r["member"] for i in range(0, len(ids), SNAPSHOT_CHUNK)
+            for r in supabase.table("pipeline_snapshot_members").select("prospect_id, member").in_("prospect_id", ids[i:i + SNAPSHOT_CHUNK]).execute().data}
+
+def refresh_snapshot():
+    """Инкрементально обновляет срез за сегодня и возвращает его rollup"""
+    state = supabase.table("pipeline_snapshot_state").select("watermark, n_members, rollup").eq("id", 1).execute().data
+    full = not state or state[0].get("n_members") is None
+    rollup, wm, n_members = ({}, None, 0) if full else (state[0]["rollup"] or {}, state[0]["watermark"], state[0]["n_members"])
+    q = lambda: supabase.table("prospects").select(SNAPSHOT_COLS)
+    changed = [r for page in fetch_pages(lambda: (q() if full else q().gte("updated_at", wm)).order("id")) for r in page]
+    old, upserts = ({} if full else _snap_members([r["id"] for r in changed])), []
+    for r in changed:
+        m = _snap_member(r)
+        if old.get(r["id"]) == m: continue
+        if r["id"] in old: _snap_add(rollup, old[r["id"]], -1)
+        else: n_members += 1
+        _snap_add(rollup, m, 1); upserts.append({"prospect_id": r["id"], "member": m})
+    for i in range(0, len(upserts), SNAPSHOT_CHUNK):
+        supabase.table("pipeline_snapshot_members").upsert(upserts[i:i + SNAPSHOT_CHUNK], on_conflict="prospect_id").execute()
+    # updated_at не видит удалений: сверяем количество и только при расхождении сравниваем списки id
+    deleted = []
+    n = supabase.table("prospects").select("id", count="exact").limit(1).execute().count or 0
+    if n != n_members:
+        alive = {r["id"] for page in fetch_pages(lambda: supabase.table("prospects").select("id").order("id")) for r in page}
+        stored = {r["prospect_id"] for page in fetch_pages(lambda: supabase.table("pipeline_snapshot_members").select("prospect_id").order("prospect_id")) for r in page}
+        deleted = sorted(stored - alive)
+        for m in _snap_members(deleted).values(): _snap_add(rollup, m, -1)
+        for i in range(0, len(deleted), SNAPSHOT_CHUNK):
+            supabase.table("pipeline_snapshot_members").delete().in_("prospect_id", deleted[i:i + SNAPSHOT_CHUNK]).execute()
+        n_members = len(stored) - len(deleted)
+    new_wm = max([wm or ""] + [r.get("updated_at") or "" for r in changed]) or datetime.now().isoformat()
+    if full or upserts or deleted or new_wm != wm:
+        supabase.table("pipeline_snapshot_state").upsert({"id": 1, "watermark": new_wm, "n_members": n_members, "rollup": rollup}).execute()
+    supabase.table("pipeline_snapshots").upsert({"day": datetime.now().date().isoformat(), "rollup": rollup}, on_conflict="day").execute()
+    return rollup
+
+@tracked_cache(ttl=600, max_entries=4)
+def _fetch_snapshot_history(v, day, days):
     try:
-        res = supabase.table("samples").select("id", count="exact").is_("feedback", "null").lte("date_sent", fifteen_days_ago).execute()
-        return res.count if res.count else 0
-    except: return 0
+        refresh_snapshot()
+        since = (datetime.now() - timedelta(days=days)).date().isoformat()
+        return supabase.table("pipeline_snapshots").select("day, rollup").gte("day", since).order("day").execute().data
+    except Exception as e:
+        # Таблиц срезов нет: только текущее состояние, посчитанное по живой таблице
+        perf_swallow("snapshots", e)
+        return [{"day": day, "rollup": _rollup_from_frame(get_data())}]
+
+def get_snapshot_history(days=182):
+    """История ежедневных агрегатов (последний элемент — сегодняшний срез)"""
+    return _fetch_snapshot_history(data_version("prospects"), datetime.now().date().isoformat(), days)
+
+def rollup_frame(hist, dim):
+    """Длинная таблица day / key / count / tonnage для одного измерения"""
+    return pd.DataFrame([(h["day"], k, c[0], c[1]) for h in hist for k, c in (h["rollup"] or {}).get(dim, {}).items()],
+                        columns=["day", dim, "count", "tonnage"])
+
+# --- 4.3 CONTACT SEARCH INDEX ---
+def fold_text(s):
+    """Нормализация для поиска: без акцентов, нижний регистр"""
+    s = unicodedata.normalize("NFKD", str(s or ""))
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+
+class ContactIndex:
+    """Поисковый индекс по контактам: отсортированный словарь токенов (префиксы через bisect),
+    триграммы словаря (опечатки и поиск внутри слова) и постинги token -> строки с весом поля"""
+    FIELDS = {"name": 1.0, "Entreprise": 1.0, "role": 0.8, "email": 0.6, "phone": 0.6}
+
+    def __init__(self, frame):
+        self.frame = frame.reset_index(drop=True)
+        post = {}
+        for f, w in self.FIELDS.items():
+            for i, v in enumerate(self.frame[f].tolist()):
+                txt = fold_text(v)
+                toks = set(re.findall(r"[a-z0-9]+", txt))
+                if f == "phone" and txt: toks.add(re.sub(r"\D", "", txt))
+                for t in toks:
+                    d = post.setdefault(t, {})
+                    if d.get(i, 0) < w: d[i] = w
+        self.vocab = sorted(t for t in post if t)
+        self.post = [(np.fromiter(post[t].keys(), dtype=np.int32), np.fromiter(post[t].values(), dtype=np.float32)) for t in self.vocab]
+        self.grams = {}
+        for ti, t in enumerate(self.vocab):
+            for g in self._grams(t): self.grams.setdefault(g, []).append(ti)
+
+    @staticmethod
+    def _grams(t):
+        t = f" {t} "
+        return {t[i:i + 3] for i in range(len(t) - 2)}
+
+    def _matches(self, q):
+        """Токены словаря для одного слова запроса: {token_id: оценка}"""
+        out = {}
+        i = bisect.bisect_left(self.vocab, q)
+        while i < len(self.vocab) and self.vocab[i].startswith(q):
+            out[i] = 3.0 if self.vocab[i] == q else 2.0; i += 1
+        if len(q) >= 3:
+            qg = self._grams(q); cnt = {}
+            for g in qg:
+                for ti in self.grams.get(g, ()): cnt[ti] = cnt.get(ti, 0) + 1
+            for ti, c in cnt.items():
+                sim = c / len(qg)
+                if sim >= 0.5 and ti not in out: out[ti] = 1.5 * sim
+        return out
+
+    def search(self, query, k=200):
+        """Индексы строк frame, отсортированные по релевантности (все слова запроса должны совпасть)"""
+        words = re.findall(r"[a-z0-9]+", fold_text(query))
+        if not words: return list(range(len(self.frame)))
+        total = np.zeros(len(self.frame), dtype=np.float32); hits = np.zeros(len(self.frame), dtype=np.int16)
+        for w in words:
+            best = np.zeros(len(self.frame), dtype=np.float32)
+            for ti, sc in self._matches(w).items():
+                rows, wt = self.post[ti]
+                np.maximum.at(best, rows, wt * sc)
+            total += best; hits += best > 0
+        ok = np.flatnonzero(hits == len(words))
+        if not len(ok): return []
+        top = ok[np.argsort(-total[ok], kind="stable")[:k]]
+        return top.tolist()
+
+@tracked_cache(resource=True, max_entries=2)
+def _contact_index(v, names):
+    cons = get_joined("contacts")
+    if cons.empty: return None
+    return ContactIndex(cons.rename(columns={'Client': 'Entreprise'})[['name', 'role', 'email', 'phone', 'Entreprise']])
+
+@tracked_cache(resource=True, max_entries=2)
+def _company_names_fp(vp):
+    """Отпечаток пар id -> company_name (не зависит от порядка строк): статусы, переносы Kanban и прочие
+    правки prospects его не меняют"""
+    p = live_frame("prospects")
+    return int(pd.util.hash_pandas_object(p[['id', 'company_name']], index=False).sum()) if not p.empty else 0
+
+def get_contact_index():
+    """Индекс контактов, перестраивается только при изменении contacts (или названий компаний)"""
+    return _contact_index(data_version("contacts"), _company_names_fp(data_version("prospects")))
+
+# --- 4.4 XLSX EXPORT ---
+# Лист за листом, страницами по EXPORT_PAGE строк: xlsxwriter в режиме constant_memory сбрасывает каждую строку
+# во временный файл, поэтому память не растет с размером выгрузки.
+EXPORT_PAGE = 1000
+EXPORT_SHEETS = {
+    "Pipeline": ("prospects", ["company_name", "status", "country", "product_interest", "segment", "potential_volume", "last_action_date", "last_salon", "website_url"]),
+    "Samples": ("samples", ["date_sent", "product_name", "reference", "status", "feedback"]),
+    "Contacts": ("contacts", ["name", "role", "email", "phone"]),
+}
+
+def export_workbook(path, p_f=None, s_f=None, py_f=None):
+    """Пишет выгрузку Pipeline/Samples/Contacts с фильтрами Pipeline в path, возвращает число строк по листам"""
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True})
+    head = wb.add_format({"bold": True, "font_color": "#ffffff", "bg_color": "#047857"})
+    counts, filtered = {}, bool(p_f or s_f or py_f)
+    for sheet, (t, cols) in EXPORT_SHEETS.items():
+        ws = wb.add_worksheet(sheet)
+        if t == "prospects":
+            header, make = cols, lambda: pipeline_filters(supabase.table(t).select(", ".join(["id"] + cols)), p_f, s_f, py_f).order("id")
+        else:
+            # Дочерние таблицы фильтруются по полям своего проспекта (inner join только при активных фильтрах)
+            header = ["company_name"] + cols
+            emb = "prospects!inner(company_name)" if filtered else "prospects(company_name)"
+            make = lambda t=t, cols=cols, emb=emb: pipeline_filters(supabase.table(t).select(", ".join(["id"] + cols + [emb])), p_f, s_f, py_f, prefix="prospects.").order("id")
+        ws.write_row(0, 0, header, head)
+        ws.set_column(0, len(header) - 1, 18)
+        n = 0
+        for page in fetch_pages(make, EXPORT_PAGE):
+            for r in page:
+                if "prospects" in r: r["company_name"] = (r.pop("prospects") or {}).get("company_name", "-")
+                n += 1; ws.write_row(n, 0, [r.get(c) for c in header])
+        counts[sheet] = n
+    wb.close()
+    return counts
+
+# --- 4.5 IMPORT (SALONS) ---
+IMPORT_CHUNK = 500
+# Колонки файла -> поля базы (заголовки сравниваются без акцентов и регистра)
+IMPORT_ALIASES = {
+    "company_name": ["company_name", "societe", "entreprise", "company", "raison sociale"],
+    "country": ["country", "pays"], "status": ["status", "statut"],
+    "product_interest": ["product_interest", "produit", "ingredient", "product"],
+    "segment": ["segment", "application"], "potential_volume": ["potential_volume", "potentiel", "volume", "potentiel (t)"],
+    "website_url": ["website_url", "site web", "site", "website"], "last_salon": ["last_salon", "salon", "source"],
+    "contact_name": ["contact_name", "contact", "nom", "name"], "contact_role": ["contact_role", "poste", "role", "fonction"],
+    "contact_email": ["contact_email", "email", "e-mail", "mail"], "contact_phone": ["contact_phone", "tel", "telephone", "phone"],
+}
+LEGAL_SUFFIXES = r"\b(sas|sasu|sarl|sa|sca|eurl|gmbh|ag|kg|bv|nv|spa|srl|sl|ltd|limited|llc|inc|plc|co|cie|group|groupe)\b"
+
+def company_key(names):
+    """Нормализованный ключ названия компании (Series): без акцентов, регистра, пунктуации и правовой формы"""
+    k = names.fillna("").astype(str).map(fold_text)
+    k = k.str.replace(r"[^a-z0-9]+", " ", regex=True).str.replace(LEGAL_SUFFIXES, " ", regex=True)
+    return k.str.split().str.join(" ")
+
+def contact_key(values):
+    """Ключ дедупликации контактов (email или имя): без акцентов, регистра и пунктуации; "" для пустых"""
+    return values.fillna("").astype(str).map(fold_text).str.replace(r"[^a-z0-9@.]+", " ", regex=True).str.split().str.join(" ")
+
+@tracked_cache(ttl=600, max_entries=2)
+def _fetch_company_index(v):
+    names = pd.DataFrame([r for page in fetch_pages(lambda: supabase.table("prospects").select("id, company_name").order("id")) for r in page])
+    if names.empty: return {}
+    names['key'] = company_key(names['company_name'])
+    names = names[names['key'] != ""]  # название из одной правовой формы ("SA") ни с чем не сравнивается
+    return names.drop_duplicates('key').set_index('key')['id'].to_dict()
+
+def get_company_index():
+    """Индекс существующих компаний: нормализованный ключ -> id"""
+    return _fetch_company_index(data_version("prospects"))
+
+def read_import_file(f):
+    """CSV (разделитель определяется автоматически) или XLSX -> DataFrame с каноническими колонками"""
+    raw = pd.read_excel(f, dtype=str) if f.name.lower().endswith(("xlsx", "xls")) else pd.read_csv(f, sep=None, engine="python", dtype=str)
+    lookup = {fold_text(a): col for col, al in IMPORT_ALIASES.items() for a in al}
+    raw = raw.rename(columns=lambda c: lookup.get(fold_text(c).strip(), c))
+    raw = raw.loc[:, ~raw.columns.duplicated()]
+    out = raw.reindex(columns=list(IMPORT_ALIASES)).astype("string").apply(lambda c: c.str.strip()).replace("", pd.NA)
+    return out.astype(object).where(out.notna(), None)
+
+def _canon(values, opts, brand=False):
+    """Приведение значений к справочнику (без акцентов/регистра; для продуктов достаточно бренда)"""
+    norm = lambda v: re.sub(r"[^a-z0-9&]+", " ", fold_text(v)).strip()
+    m = {norm(o): o for o in opts}
+    if brand: m.update({norm(clean_prod_name(o)): o for o in opts})
+    return values.map(lambda v: m.get(norm(v)) if pd.notna(v) else None)
+
+def plan_import(raw, salon, index):
+    """Сухой прогон: проверка справочников и дедупликация (векторно). Возвращает подготовленный DataFrame"""
+    df = raw.copy()
+    df['status_ok'] = _canon(df['status'], STATUS_OPTS)
+    df['product_ok'] = _canon(df['product_interest'], PRODUCT_OPTS, brand=True)
+    df['segment_ok'] = _canon(df['segment'], SEGMENT_OPTS)
+    df['key'] = company_key(df['company_name'])
+    vol = pd.to_numeric(df['potential_volume'].str.replace(",", ".").str.replace(r"[^\d.]", "", regex=True), errors="coerce")
+    errors = pd.DataFrame({
+        "Société manquante": df['company_name'].isna(),
+        "Nom de société invalide": df['company_name'].notna() & (df['key'] == ""),  # только правовая форма
+        "Statut inconnu": df['status'].notna() & df['status_ok'].isna(),
+        "Produit inconnu": df['product_interest'].notna() & df['product_ok'].isna(),
+        "Application inconnue": df['segment'].notna() & df['segment_ok'].isna(),
+        "Potentiel invalide": df['potential_volume'].notna() & vol.isna(),
+    })
+    df['erreurs'] = errors.dot(errors.columns + ", ").str.rstrip(", ")
+    df['potential_volume'] = vol.fillna(0.0)
+    df['status'] = df['status_ok'].fillna("Prospection")
+    df['product_interest'], df['segment'] = df['product_ok'], df['segment_ok']
+    df['last_salon'] = df['last_salon'].fillna(salon or None)
+    df['existing_id'] = df['key'].map(index)
+    valid = df['erreurs'] == ""
+    df['action'] = np.select([~valid, df['existing_id'].notna(), df['key'].where(valid).duplicated() & valid],
+                             ["invalide", "doublon (base)", "doublon (fichier)"], "nouveau")
+    return df.drop(columns=['status_ok', 'product_ok', 'segment_ok'])
+
+def run_import(plan, attach_contacts=True):
+    """Вставка пакетами: новые проспекты, затем их контакты (и контакты существующих компаний)"""
+    cols = ["company_name", "country", "status", "product_interest", "segment", "potential_volume", "website_url", "last_salon"]
+    new = plan[plan['action'] == "nouveau"]
+    now = datetime.now().isoformat()
+    ids = plan.loc[plan['existing_id'].notna()].set_index('key')['existing_id'].astype(int).to_dict() if attach_contacts else {}
+    for i in range(0, len(new), IMPORT_CHUNK):
+        chunk = new.iloc[i:i + IMPORT_CHUNK]
+        rows = [{**{c: (None if pd.isna(v) else v) for c, v in r.items()}, "last_action_date": now} for r in chunk[cols].to_dict('records')]
+        res = db_write("prospects").insert(rows).execute()
+        ids.update(zip(chunk['key'], (r['id'] for r in res.data)))
+    ok = plan[(plan['action'] != "invalide") & plan['contact_name'].notna() & plan['key'].isin(ids)]
+    # Контакт уже есть у компании (или выше в файле), если совпадает email или имя: повторный импорт ничего не дублирует
+    have = live_frame("contacts")
+    have = have[have['prospect_id'].isin(set(ids.values()))] if not have.empty else have
+    seen = set(zip(have['prospect_id'], contact_key(have['email']))) | set(zip(have['prospect_id'], contact_key(have['name']))) if not have.empty else set()
+    contacts = []
+    for r, ke, kn in zip(ok.astype(object).where(ok.notna(), None).to_dict('records'), contact_key(ok['contact_email']), contact_key(ok['contact_name'])):
+        pid = ids[r['key']]
+        if (pid, kn) in seen or (ke and (pid, ke) in seen): continue
+        seen.update({(pid, kn), (pid, ke)} - {(pid, "")})
+        contacts.append({"prospect_id": pid, "name": r['contact_name'], "role": r['contact_role'] or "", "email": r['contact_email'] or "", "phone": r['contact_phone'] or ""})
+    for i in range(0, len(contacts), IMPORT_CHUNK):
+        db_write("contacts").insert(contacts[i:i + IMPORT_CHUNK]).execute()
+    return len(new), len(contacts)
+
+# --- 4.6 ALERT RULES ---
+# Правила проверяются одним векторным проходом по закэшированным таблицам; результат материализуется
+# один раз на (день, пороги, версии samples/prospects) и общий для всех сессий: бейдж, Alertes и Pipeline.
+# Пороги переопределяются в secrets.toml, секция [alert_days] (0 — правило отключено).
+ALERT_RULES = {
+    "sample_feedback": {"label": "Échantillon sans retour R&D", "days": 15},
+    "untouched": {"label": "Prospect sans contact", "days": 30},
+    "stuck": {"label": "Bloqué dans le statut", "days": 45},
+}
+ALERT_DONE_STATUSES = ("Client signé",)  # из этих статусов не "застревают"
+
+def alert_rules():
+    days = setting("alert_days", {})
+    return {k: {**r, "days": int(days.get(k, r["days"]))} for k, r in ALERT_RULES.items()}
+
+def _age_days(col, today):
+    """Дней с даты (ISO-строки; пустые и нераспознанные -> NaN)"""
+    return (today - pd.to_datetime(col.astype("string").str[:10], errors='coerce')).dt.days
+
+@tracked_cache(resource=True, max_entries=2)
+def _alerts(day, rules, v, vp):
+    """Срабатывания всех правил (только чтение: объект общий для сессий)"""
+    today, days = pd.Timestamp(day), dict(rules)
+    p, hits = live_frame("prospects"), []
+    if not p.empty:
+        if days.get("untouched"):
+            age = _age_days(p['last_action_date'], today)
+            m = age >= days["untouched"]
+            hits.append(pd.DataFrame({"rule": "untouched", "prospect_id": p['id'][m], "days": age[m], "detail": "Dernier contact"}))
+        if days.get("stuck"):
+            # status_changed_at, если колонка есть; иначе последнее изменение строки или контакта (приближение)
+            since = pd.Series(pd.NA, index=p.index, dtype=object)
+            for c in ("status_changed_at", "updated_at", "last_action_date"):
+                if c in p: since = since.fillna(p[c])
+            age = _age_days(since, today)
+            m = (age >= days["stuck"]) & ~p['status'].isin(ALERT_DONE_STATUSES)
+            hits.append(pd.DataFrame({"rule": "stuck", "prospect_id": p['id'][m], "days": age[m], "detail": p['status'][m].astype(object).fillna("-")}))
+    s = live_frame("samples")
+    s = s[s['feedback'].isna()] if not s.empty else s
+    if days.get("sample_feedback") and not s.empty:
+        age = _age_days(s['date_sent'], today)
+        m = age >= days["sample_feedback"]
+        hits.append(pd.DataFrame({"rule": "sample_feedback", "prospect_id": s['prospect_id'][m], "days": age[m],
+                                  "detail": s['product_name'][m].astype(object).map(clean_prod_name) + " " + s['reference'][m].fillna("")}))
+    al = pd.concat(hits, ignore_index=True) if hits else pd.DataFrame(columns=["rule", "prospect_id", "days", "detail"])
+    al['days'] = al['days'].astype(int)
+    al['since'] = today - pd.to_timedelta(al['days'], unit="D")
+    al['company_name'] = al['prospect_id'].map(p.set_index('id')['company_name'] if not p.empty else {}).fillna("-")
+    al = al.sort_values('days', ascending=False, kind="stable").reset_index(drop=True)
+    return {"alerts": al, "counts": al['rule'].value_counts().to_dict(), "prospects": al['prospect_id'].nunique(),
+            "untouched": frozenset(al.loc[al['rule'] == "untouched", 'prospect_id'])}
+
+def get_alerts():
+    """Алерты на сегодня для текущих версий данных"""
+    return _alerts(datetime.now().date().isoformat(), tuple((k, r["days"]) for k, r in alert_rules().items()), data_version("samples"), data_version("prospects"))
+
+# --- 4.7 LIVE STORE ---
+# Таблицы LIVE_TABLES грузятся в память процесса один раз (st.cache_resource, общий для всех сессий) и дальше
+# обновляются дельтами INSERT/UPDATE/DELETE: из Supabase Realtime (postgres_changes), а пока канал не подписан —
+# опросом по updated_at раз в LIVE_POLL сек. После подписки — один догоняющий опрос и сверка раз в LIVE_RECONCILE сек.
+# (таблица вне публикации подписывается без ошибок, но событий не шлет). Каждая дельта, реально изменившая строку, увеличивает версии таблицы
+# и проспекта (touch), так что кэши по версиям сбрасываются точечно и после правок из других процессов.
+# Свои записи (db_write) применяются сразу из ответа; их эхо из канала совпадает со строкой и ничего не сбрасывает.
+# Схема: у live-таблиц колонка updated_at с триггером (как у prospects, см. 4.2) и публикация supabase_realtime.
+# INGOOD_LIVE_SOURCE=realtime|poll|feed выбирает источник; feed — журнал changes локальной базы (fake_supabase.py).
+LIVE_TABLES = ("prospects", "samples", "contacts")
+LIVE_POLL = 5  # сек. между опросами
+LIVE_RELOAD = 60  # сек. между полными перечитываниями, если опрос по updated_at невозможен
+LIVE_RECONCILE = 120  # сек. между сверочными опросами при подписанном канале Realtime
+LIVE_RETRY = 10  # сек. до повторной загрузки таблицы после ошибки (до тех пор — пустой кадр)
+LIVE_ORDER = {"prospects": ("last_action_date", False)}  # порядок кадра, как у прежней выборки
+# Проекции live-таблиц: длинные тексты (notes, tech_notes) в общий кадр не попадают — их приносит только карточка (_fetch_card).
+# Необязательные колонки (LIVE_OPTIONAL) берутся, только если они есть в схеме; повторяющиеся строки — категории.
+LIVE_COLUMNS = {
+    "prospects": "id, company_name, status, country, product_interest, segment, potential_volume, last_action_date, last_salon, website_url",
+    "samples": "id, prospect_id, product_name, reference, status, date_sent, feedback",
+    "contacts": "id, prospect_id, name, role, email, phone",
+}
+LIVE_OPTIONAL = {"prospects": ("updated_at", "status_changed_at"), "samples": ("updated_at",), "contacts": ("updated_at",)}
+LIVE_CATEGORIES = {"prospects": ("status", "country", "product_interest", "segment", "last_salon"), "samples": ("status", "product_name")}
+
+class LiveTable:
+    """Строки таблицы по id и кадр pandas, пересобираемый только после изменений"""
+    def __init__(self, t, rows, select="*"):
+        self.t, self.select, self.rows, self.rev, self._frame = t, select, {r['id']: r for r in rows}, 0, None
+        self.cols = None if select == "*" else [c.strip() for c in select.split(",")]
+        self.watermark = max((r.get('updated_at') or "" for r in rows), default="")
+
+    def apply(self, kind, row):
+        """Применяет дельту; возвращает затронутую строку или None, если ничего не изменилось"""
+        old = self.rows.get(row.get('id'))
+        if self.cols: row = {k: v for k, v in row.items() if k in self.cols}  # полные строки из realtime/db_write
+        if kind == "DELETE":
+            if old is None: return None
+            del self.rows[row['id']]
+        else:
+            new = {**(old or {}), **row}
+            if new == old: return None
+            self.rows[row['id']] = new
+            self.watermark = max(self.watermark, row.get('updated_at') or "")
+        self.rev += 1
+        return old or row
+
+    def frame(self):
+        if self._frame is None or self._frame[0] != self.rev:
+            df = pd.DataFrame(list(self.rows.values()), columns=self.cols)
+            for c in LIVE_CATEGORIES.get(self.t, ()): df[c] = df[c].astype("category")
+            if self.t in LIVE_ORDER and not df.empty:
+                c, asc = LIVE_ORDER[self.t]; df = df.sort_values(c, ascending=asc, na_position="last", kind="stable", ignore_index=True)
+            self._frame = (self.rev, df)
+        return self._frame[1]
+
+class FeedSource:
+    """Дельты из списка (table, kind, row), который дописывает локальная база (FakeClient.changes)"""
+    def __init__(self, feed):
+        self.feed, self.pos = feed, len(feed)
+
+    def drain(self, store):
+        out = self.feed[self.pos:]; self.pos += len(out)
+        return out
+
+class PollingSource:
+    """Опрос updated_at >= watermark; удаления — сверкой количества строк, без updated_at — полное перечитывание"""
+    def __init__(self, client, every=LIVE_POLL):
+        self.client, self.every, self.last, self.reloaded = client, every, 0.0, {}
+
+    def _ids(self, t):
+        return {r['id'] for page in fetch_pages(lambda: self.client.table(t).select("id").order("id")) for r in page}
+
+    def drain(self, store, every=None):
+        if time.time() - self.last < (self.every if every is None else every): return []
+        self.last, out = time.time(), []
+        with store.lock:  # короткий снимок; сетевые запросы — уже без блокировки чтений
+            tables = [(t, lt, set(lt.rows), lt.watermark) for t, lt in store.tables.items()]
+        for t, lt, known, wm in tables:
+            try:
+                if lt.cols and "updated_at" not in lt.cols: raise LookupError(f"{t}.updated_at absent")
+                rows = [r for page in fetch_pages(lambda: self.client.table(t).select(lt.select).gte("updated_at", wm or "1970-01-01").order("id")) for r in page]
+            except Exception as e:
+                perf_swallow(f"live_poll:{t}", e)
+                if time.time() - self.reloaded.get(t, 0) < LIVE_RELOAD: continue
+                self.reloaded[t] = time.time()
+                rows = [r for page in fetch_pages(lambda: self.client.table(t).select(lt.select).order("id")) for r in page]
+                alive = {r['id'] for r in rows}
+            else:
+                n = self.client.table(t).select("id", count="exact").limit(1).execute().count or 0
+                alive = None if n == len(known | {r['id'] for r in rows}) else self._ids(t)
+            out += [(t, "UPDATE", r) for r in rows]
+            if alive is not None: out += [(t, "DELETE", {"id": i}) for i in known - alive]
+        return out
+
+class RealtimeSource:
+    """Канал Supabase Realtime в фоновом потоке со своим event loop; пока канал не подписан — fallback-опрос"""
+    def __init__(self, url, key, tables, fallback):
+        self.buf, self.fallback, self.state, self.caught_up = deque(), fallback, None, False
+        threading.Thread(target=lambda: asyncio.run(self._listen(url, key, tables)), daemon=True).start()
+
+    async def _listen(self, url, key, tables):
+        try:
+            from realtime import AsyncRealtimeClient
+            rt = AsyncRealtimeClient(f"{url.rstrip('/')}/realtime/v1", key)
+            await rt.connect()
+            ch = rt.channel("ingood-live")
+            for t in tables: ch.on_postgres_changes("*", callback=self._on_change, table=t, schema="public")
+            await ch.subscribe(lambda state, err: setattr(self, "state", str(getattr(state, "value", state))))
+            await asyncio.Event().wait()
+        except Exception as e: self.state = f"ERROR: {e}"
+
+    def _on_change(self, payload):
+        d = payload.get("data", payload)
+        kind = d.get("type") or d.get("eventType")
+        self.buf.append((d.get("table"), kind, d.get("old_record") if kind == "DELETE" else d.get("record")))
+
+    def drain(self, store):
+        if self.state != "SUBSCRIBED": return self.fallback.drain(store)
+        out = []
+        while self.buf: out.append(self.buf.popleft())
+        # Первый опрос сразу (правки между прошлым опросом и подпиской), дальше — редкая сверка
+        every, self.caught_up = (LIVE_RECONCILE if self.caught_up else 0), True
+        return out + self.fallback.drain(store, every)
+
+class LiveStore:
+    def __init__(self, client, source):
+        self.client, self.source, self.tables, self.failed = client, source, {}, {}
+        self.lock, self.sync_lock = threading.RLock(), threading.Lock()  # данные / один сеанс-синхронизатор
+
+    def table(self, t):
+        """LiveTable (первое обращение загружает таблицу целиком); при ошибке загрузки — пустая таблица
+        и повторная попытка не раньше чем через LIVE_RETRY сек."""
+        with self.lock:
+            if t not in self.tables:
+                if time.time() - self.failed.get(t, 0) < LIVE_RETRY: return LiveTable(t, [], LIVE_COLUMNS.get(t, "*"))
+                try:
+                    sel = self._select(t)
+                    self.tables[t] = LiveTable(t, [r for page in fetch_pages(lambda: self.client.table(t).select(sel).order("id")) for r in page], sel)
+                    if self.failed.pop(t, None): touch(t)  # кэши, посчитанные по пустому кадру
+                except Exception as e:
+                    self.failed[t] = time.time()
+                    return perf_swallow(f"live_load:{t}", e, LiveTable(t, [], LIVE_COLUMNS.get(t, "*")))
+            return self.tables[t]
+
+    def _select(self, t):
+        """Проекция таблицы + необязательные колонки, которые есть в схеме"""
+        cols = [LIVE_COLUMNS.get(t, "*")]
+        for c in LIVE_OPTIONAL.get(t, ()) if t in LIVE_COLUMNS else ():
+            try: self.client.table(t).select(c).limit(1).execute(); cols.append(c)
+            except Exception as e: perf_swallow(f"live_schema:{t}.{c}", e)
+        return ", ".join(cols)
+
+    def frame(self, t):
+        """Общий кадр таблицы — только чтение"""
+        with self.lock: return self.table(t).frame()
+
+    def apply(self, deltas, silent=False, vs=None):
+        """Применяет дельты к загруженным таблицам; silent — версии увеличивает вызывающий (db_write)"""
+        touched = {}
+        with self.lock:
+            for t, kind, row in deltas:
+                lt = self.tables.get(t)
+                hit = lt.apply(kind, row) if lt is not None and row and row.get('id') is not None else row
+                if hit is not None: touched.setdefault(t, set()).add(hit.get('id') if t == "prospects" else hit.get('prospect_id'))
+        if not silent:
+            for t, pids in touched.items(): touch(t, *pids, vs=vs)
+
+    def sync(self):
+        """Забирает накопленные дельты; одновременно синхронизирует только один сеанс.
+        drain() идет под sync_lock: чтения кадров другими сеансами не ждут сетевых запросов опроса"""
+        if not self.sync_lock.acquire(blocking=False): return
+        try: deltas = self.source.drain(self)
+        except Exception as e: deltas = perf_swallow("live_sync", e, [])
+        finally: self.sync_lock.release()
+        if deltas: self.apply(deltas)
+
+def _live_source():
+    kind = os.environ.get("INGOOD_LIVE_SOURCE") or ("feed" if os.environ.get("INGOOD_FAKE_DB") else "realtime")
+    if kind == "feed": return FeedSource(supabase.changes)
+    poll = PollingSource(supabase)
+    return poll if kind == "poll" else RealtimeSource(setting("SUPABASE_URL"), setting("SUPABASE_KEY"), LIVE_TABLES, poll)
+
+@st.cache_resource
+def live_store():
+    """Live-store процесса"""
+    return LiveStore(supabase, _live_source())
+
+def live_frame(t):
+    return live_store().frame(t)
 
 # --- 5. MODAL: FICHE PROSPECT (ПОЛНАЯ ВЕРСИЯ С СИНХРОНИЗАЦИЕЙ) ---
-@st.dialog(" ", width="large")
-def show_prospect_card(pid, data):
-    pid = int(pid)
+@st.dialog(" ", width="large", on_dismiss=close_prospect_card)
+def show_prospect_card(pid, card):
+    pid, data = int(pid), card["prospect"]
     st.markdown(f"<h2 style='margin-top: -30px; margin-bottom: 25px; font-size: 24px; color: #1e293b; font-weight: 800; border-bottom: 1px solid #f1f5f9; padding-bottom: 10px;'>{data['company_name']}</h2>", unsafe_allow_html=True)
     c_left, c_right = st.columns([1, 2], gap="large")
 
@@ -204,7 +1254,7 @@ def show_prospect_card(pid, data):
     with c_left:
         with st.container(border=True):
             name = st.text_input("SOCIÉTÉ", value=data['company_name'], key=f"n_{pid}")
-            opts = ["Prospection", "Qualification", "Echantillon", "Test R&D", "Essai industriel", "Négociation", "Client signé"]
+            opts = STATUS_OPTS
             stat = st.selectbox("STATUT", opts, index=next((i for i, s in enumerate(opts) if s in data.get("status", "")), 0))
             
             cl1, cl2 = st.columns(2)
@@ -215,15 +1265,16 @@ def show_prospect_card(pid, data):
             
             last_c_str = data.get("last_action_date") or datetime.now().strftime("%Y-%m-%d")
             try: last_c_date = st.date_input("DERNIER CONTACT", value=datetime.strptime(last_c_str[:10], "%Y-%m-%d"))
-            except: last_c_date = st.date_input("DERNIER CONTACT", value=datetime.now())
+            except (TypeError, ValueError): last_c_date = st.date_input("DERNIER CONTACT", value=datetime.now())
             
             st.markdown("---")
             st.markdown("<p class='field-label'>🪄 AI SMART RESEARCH & EMAIL</p>", unsafe_allow_html=True)
             tone = st.selectbox("Ton", ["Professionnel", "Relance amicale", "Urgent / Technique"], key=f"ai_tone_{pid}")
             if st.button("✨ Исследовать и Составить", use_container_width=True):
-                with st.spinner("Analyse du web en cours..."):
-                    st.session_state['ai_draft'] = ai_generate_smart_email(data['company_name'], data.get('product_interest'), tone, data.get('country'))
-            if 'ai_draft' in st.session_state:
+                safe_del('ai_draft')
+                st.session_state['ai_job'] = start_ai_job(data['company_name'], data.get('product_interest'), tone, data.get('country'))
+            if 'ai_job' in st.session_state: ai_draft_stream()
+            elif 'ai_draft' in st.session_state:
                 st.text_area("Brouillon AI Research", value=st.session_state['ai_draft'], height=200)
 
     # --- ПРАВАЯ КОЛОНКА ---
@@ -231,8 +1282,7 @@ def show_prospect_card(pid, data):
         t1, t2, t3 = st.tabs(["Contexte & Technique", "Suivi Samples", "Journal"])
         
         with t1:
-            prod_opts = ["LENGOOD® (Substitut Œuf)", "PEPTIPEA® (Protéine)", "NEWGOOD® (Nouveauté)"]
-            app_opts = ["Boulangerie", "Sauces", "Confiserie", "Plats cuisinés", "Boissons"]
+            prod_opts, app_opts = PRODUCT_OPTS, SEGMENT_OPTS
             cr1, cr2 = st.columns(2)
             with cr1: prod = st.selectbox("INGRÉDIENT", prod_opts, index=prod_opts.index(data.get("product_interest")) if data.get("product_interest") in prod_opts else 0)
             with cr2: app = st.selectbox("APPLICATION", app_opts, index=app_opts.index(data.get("segment")) if data.get("segment") in app_opts else 0)
@@ -243,7 +1293,8 @@ def show_prospect_card(pid, data):
             st.markdown("---")
             # --- ЛОГИКА УПРАВЛЕНИЯ КОНТАКТАМИ (СИНХРОНИЗАЦИЯ 4.0) ---
             if 'editing_contacts' not in st.session_state:
-                st.session_state['editing_contacts'] = get_sub_data("contacts", pid).to_dict('records')
+                st.session_state['editing_contacts'] = [dict(c) for c in card["contacts"]]
+                st.session_state['contacts_loaded'] = {int(c['id']): dict(c) for c in st.session_state['editing_contacts'] if c.get('id')}
 
             hc1, hc2, hc3, hc4, hc5 = st.columns([1.2, 1.2, 1.5, 1.2, 0.4])
             hc1.markdown('<span class="contact-label">Nom</span>', unsafe_allow_html=True)
@@ -274,200 +1325,344 @@ def show_prospect_card(pid, data):
             with cs2: s_prod = st.selectbox("Produit", prod_opts, key=f"sp_{pid}")
             with cs3: 
                 if st.button("Ajouter", type="primary"):
-                    supabase.table("samples").insert({"prospect_id": pid, "reference": s_ref, "product_name": s_prod, "status": "En test", "date_sent": datetime.now().isoformat()}).execute(); st.rerun()
+                    db_write("samples", pid).insert({"prospect_id": pid, "reference": s_ref, "product_name": s_prod, "status": "En test", "date_sent": datetime.now().isoformat()}).execute(); st.rerun()
             st.markdown("---")
-            for _, r in get_sub_data("samples", pid).iterrows():
+            sample_flush_timer(pid)
+            pend = st.session_state.get('pending_samples', {})
+            for r in card["samples"]:
+                r = {**r, **pend.get(int(r['id']), {})}  # правки из буфера поверх кэша
                 with st.container(border=True):
                     ch1, ch2, ch3 = st.columns([3.5, 1.5, 0.5])
                     with ch1: st.markdown(f"**{clean_prod_name(r['product_name'])}** {r['reference']} <small>({r['date_sent'][:10]})</small>", unsafe_allow_html=True)
                     with ch2:
                         s_opts = ["En test", "Validé", "Rejeté", "Perdu"]
-                        new_s = st.selectbox("S", s_opts, index=s_opts.index(r['status']) if r['status'] in s_opts else 0, key=f"ss_{r['id']}", label_visibility="collapsed")
-                        if new_s != r['status']: supabase.table("samples").update({"status": new_s}).eq("id", r['id']).execute()
+                        st.selectbox("S", s_opts, index=s_opts.index(r['status']) if r['status'] in s_opts else 0, key=f"ss_{r['id']}", label_visibility="collapsed",
+                                     on_change=queue_sample_edit, args=(r, "status", f"ss_{r['id']}"))
                     with ch3:
                         st.markdown('<div class="trash-container" style="height:32px;">', unsafe_allow_html=True)
-                        if st.button("🗑️", key=f"ds_{r['id']}"): supabase.table("samples").delete().eq("id", r['id']).execute(); st.rerun()
+                        if st.button("🗑️", key=f"ds_{r['id']}"): pend.pop(int(r['id']), None); db_write("samples", pid).delete().eq("id", r['id']).execute(); st.rerun()
                         st.markdown('</div>', unsafe_allow_html=True)
-                    new_f = st.text_area("Feedback R&D", value=r.get("feedback",""), key=f"f_{r['id']}", height=60, label_visibility="collapsed")
-                    if new_f != r.get("feedback",""): supabase.table("samples").update({"feedback": new_f}).eq("id", r['id']).execute()
+                    st.text_area("Feedback R&D", value=r.get("feedback",""), key=f"f_{r['id']}", height=60, label_visibility="collapsed",
+                                 on_change=queue_sample_edit, args=(r, "feedback", f"f_{r['id']}"))
 
         with t3:
             note = st.text_area("Nouvelle activité...", key=f"act_n_{pid}")
             if st.button("Enregistrer"):
-                supabase.table("activities").insert({"prospect_id": pid, "type": "Note", "content": note, "date": datetime.now().isoformat()}).execute(); st.rerun()
-            for _, act in get_sub_data("activities", pid).iterrows():
-                st.caption(f"🗓️ {act['date'][:10]}"); st.write(act['content'])
+                db_write("activities", pid).insert({"prospect_id": pid, "type": "Note", "content": note, "date": datetime.now().isoformat()}).execute(); st.rerun()
+            pages = st.session_state.get(f'journal_p_{pid}', 0)
+            acts, more = list(card["activities"]), card["more"]
+            for page in range(1, pages + 1):
+                chunk = get_journal(pid, page); acts += chunk[:JOURNAL_PAGE]; more = len(chunk) > JOURNAL_PAGE
+            for act in acts:
+                st.caption(f"🗓️ {(act.get('date') or '')[:10]}"); st.write(act['content'])
+            if more and st.button("Afficher les activités plus anciennes", key=f"journal_more_{pid}"):
+                st.session_state[f'journal_p_{pid}'] = pages + 1; st.rerun()
 
     st.markdown("---")
     if st.button("Enregistrer & Fermer la Fiche", type="primary", use_container_width=True):
         try:
             # 1. Update Prospect
             upd = {"company_name": name, "status": stat, "country": pays, "potential_volume": float(vol), "website_url": web_url, "last_action_date": last_c_date.isoformat(), "product_interest": prod, "segment": app, "notes": pain, "tech_notes": tech}
-            supabase.table("prospects").update(upd).eq("id", pid).execute()
-            # 2. Sync Contacts (Deletions + Upserts)
-            if 'contacts_to_delete' in st.session_state:
-                supabase.table("contacts").delete().in_("id", st.session_state.pop('contacts_to_delete')).execute()
-            for rc in st.session_state.get('editing_contacts', []):
-                if str(rc.get("name")).strip():
-                    pl = {"prospect_id": pid, "name": rc["name"], "role": rc.get("role",""), "email": rc.get("email",""), "phone": rc.get("phone","")}
-                    if rc.get("id"): supabase.table("contacts").upsert({**pl, "id": int(rc["id"])}).execute()
-                    else: supabase.table("contacts").insert(pl).execute()
+            db_write("prospects", pid).update(upd).eq("id", pid).execute()
+            flush_sample_edits(force=True)
+            # 2. Sync Contacts (bulk: deletions + changed + new)
+            sync_contacts(pid, st.session_state.get('editing_contacts', []), st.session_state.get('contacts_loaded', {}), st.session_state.pop('contacts_to_delete', []))
             reset_pipeline(); st.rerun()
         except Exception as e: st.error(f"Error logic: {e}")
 
 # --- 6. SIDEBAR NAVIGATION ---
-with st.sidebar:
+live_store().sync()  # дельты до первого чтения данных в этом перезапуске
+with st.sidebar, perf_section("sidebar"):
     st.image("favicon.png", width=55); st.write("")
     if st.button("⊕ Nouveau Projet"):
-        res = supabase.table("prospects").insert({"company_name": "Nouveau Prospect", "status": "Prospection"}).execute()
+        res = db_write("prospects").insert({"company_name": "Nouveau Prospect", "status": "Prospection"}).execute()
         st.session_state['open_new_id'] = res.data[0]['id']; st.rerun()
     st.write("")
-    rc_cnt = count_relances()
-    nav_opts = {"Dashboard": "❒ Dashboard", "Pipeline": "☰ Pipeline", "Kanban": "▦ Kanban", "Samples": "🧪 Samples", "Contacts": "👤 Contacts", "Alertes": "🔔 Alerts"}
+    rc_cnt = get_alerts()["prospects"]
+    nav_opts = {"Dashboard": "❒ Dashboard", "Pipeline": "☰ Pipeline", "Kanban": "▦ Kanban", "Samples": "🧪 Samples", "Contacts": "👤 Contacts", "Alertes": "🔔 Alerts", "Import": "⇪ Import", "Perf": "⏱ Perf"}
     sel = st.radio("Navigation", list(nav_opts.keys()), format_func=lambda x: nav_opts[x], label_visibility="collapsed", index=1)
     if rc_cnt > 0:
          st.markdown(f"""<style>div[role="radiogroup"] label:nth-child(6)::after {{content: '{rc_cnt}'; background: #fee2e2; color: #ef4444; display: inline-block; font-size: 10px; font-weight: 700; padding: 1px 7px; border-radius: 10px; margin-left: auto;}}</style>""", unsafe_allow_html=True)
     st.markdown("---"); st.caption("👤 Daria • Ingood AI")
 
 # --- 7. ROUTING ---
+flush_sample_edits()
 if 'open_new_id' in st.session_state:
     st.session_state['active_prospect_id'] = st.session_state.pop('open_new_id'); reset_pipeline()
 if 'active_prospect_id' in st.session_state:
     try: 
-        row_data = supabase.table("prospects").select("*").eq("id", st.session_state['active_prospect_id']).execute().data[0]
-        show_prospect_card(st.session_state['active_prospect_id'], row_data)
-    except: safe_del('active_prospect_id')
+        card = get_card(st.session_state['active_prospect_id'])
+        if card is None: raise LookupError("prospect introuvable")
+        with perf_section("fiche"): show_prospect_card(st.session_state['active_prospect_id'], card)
+    except Exception as e: perf_swallow("fiche", e); safe_del('active_prospect_id')
 
 # --- 8. PAGES ---
+_page_t0 = time.perf_counter()
 
 # --- PAGE: PIPELINE ---
 if sel == "Pipeline":
-    df_raw = get_data()
+    prod_list, country_list = get_filter_options()
     with st.container(border=True):
         f1, f2, f3, f4 = st.columns(4)
-        with f1: p_f = st.selectbox("Produit", ["Produit: Tous"] + sorted(list(df_raw['product_interest'].dropna().unique())), label_visibility="collapsed")
+        with f1: p_f = st.selectbox("Produit", ["Produit: Tous"] + prod_list, label_visibility="collapsed")
         with f2: s_f = st.selectbox("Statut", ["Statut: Tous", "Prospection", "Qualification", "Echantillon", "Test R&D", "Négociation", "Client signé"], label_visibility="collapsed")
-        with f3: py_f = st.selectbox("Pays", ["Pays: Tous"] + sorted(list(df_raw['country'].dropna().unique())), label_visibility="collapsed")
+        with f3: py_f = st.selectbox("Pays", ["Pays: Tous"] + country_list, label_visibility="collapsed")
         with f4: st.markdown('<div class="filter-label-white" style="text-align:right; padding-top:8px;">▽ Filtres actifs</div>', unsafe_allow_html=True)
+    p_f = None if p_f == "Produit: Tous" else p_f
+    s_f = None if s_f == "Statut: Tous" else s_f
+    py_f = None if py_f == "Pays: Tous" else py_f
+
+    # Пагинация: при смене фильтров возвращаемся на первую страницу
+    if st.session_state.get('pipe_filters') != (p_f, s_f, py_f):
+        st.session_state['pipe_filters'] = (p_f, s_f, py_f); st.session_state['pipe_page'] = 1
+    page_size = st.session_state.get('pipe_size', 50)
+    df, total = get_pipeline_page(p_f, s_f, py_f, st.session_state.get('pipe_page', 1), page_size)
 
-    df = df_raw.copy()
-    if p_f != "Produit: Tous": df = df[df['product_interest'] == p_f]
-    if s_f != "Statut: Tous": df = df[df['status'].str.contains(s_f, na=False)]
-    if py_f != "Pays: Tous": df = df[df['country'] == py_f]
-    
     st.write("")
-    w = [3.5, 1.2, 1.2, 1.8, 1.8, 2.2, 1.8]
-    st.markdown('<div class="pipeline-header-row">', unsafe_allow_html=True)
-    h_c = st.columns(w)
-    labels = ["SOCIÉTÉ", "PAYS", "PRODUIT", "STATUT", "CONTACT", "SOURCE", "SAMPLES"]
-    for i, l in enumerate(labels): h_c[i].markdown(f'<span class="header-text-style">{l}</span>', unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-    s_map = pd.DataFrame(supabase.table("samples").select("prospect_id").execute().data)
-    for _, row in df.iterrows():
-        with st.container(border=True):
-            r = st.columns(w)
-            if r[0].button(row['company_name'], key=f"b_{row['id']}"):
-                st.session_state['active_prospect_id'] = row['id']; st.rerun()
-            r[1].markdown(f"<span style='color:#64748b; font-size:13px;'>{row['country'] or '-'}</span>", unsafe_allow_html=True)
-            r[2].markdown(f"<span style='color:#047857; font-weight:700; font-size:13px;'>{clean_prod_name(row['product_interest'])}</span>", unsafe_allow_html=True)
-            st_v = row['status'] or "Prospection"
-            b_c = "bg-green" if "Client" in st_v else "bg-yellow" if "Test" in st_v else "bg-gray"
-            r[3].markdown(f"<span class='badge-ui {b_c}'>{st_v}</span>", unsafe_allow_html=True)
-            if row['last_action_date']:
-                try:
-                    dt = datetime.strptime(row['last_action_date'][:10], "%Y-%m-%d")
-                    color = "#ef4444" if (datetime.now() - dt).days > 30 else "#64748b"
-                    r[4].markdown(f"<span style='color:{color}; font-weight:700; font-size:13px;'>{dt.strftime('%d %b %y')}</span>", unsafe_allow_html=True)
-                except: r[4].write("-")
-            else: r[4].write("-")
-            r[5].markdown(f"<span style='color:#64748b; font-size:13px;'>{row.get('last_salon') or '-'}</span>", unsafe_allow_html=True)
-            has_s = not s_map.empty and row['id'] in s_map['prospect_id'].values
-            if has_s: r[6].markdown("<span class='badge-ui bg-blue'>🧪 En test</span>", unsafe_allow_html=True)
-            else: r[6].write("-")
+    if df.empty: st.info("Aucun prospect pour ces filtres.")
+    else:
+        s_stats = get_sample_stats()
+        contact = pd.to_datetime(df['last_action_date'].str[:10], errors='coerce')
+        grid = pd.DataFrame({
+            "SOCIÉTÉ": df['company_name'],
+            "PAYS": df['country'].fillna('-'),
+            "PRODUIT": df['product_interest'].map(clean_prod_name),
+            "STATUT": df['status'].fillna('Prospection'),
+            "CONTACT": contact,
+            "SOURCE": df['last_salon'].fillna('-') if 'last_salon' in df else '-',
+            "SAMPLES": [f"🧪 {s['status']} ({s['n']})" if (s := s_stats.get(i)) else "-" for i in df['id']],
+        })
+        stale = df['id'].isin(get_alerts()["untouched"])
+        def sample_badge(v): return "" if v == "-" else "background-color:#dcfce7; color:#166534" if "Validé" in v else "background-color:#f1f5f9; color:#64748b" if ("Rejeté" in v or "Perdu" in v) else "background-color:#eff6ff; color:#1d4ed8"
+        def badge(v): return "background-color:#dcfce7; color:#166534" if "Client" in v else "background-color:#fef9c3; color:#854d0e" if "Test" in v else "background-color:#f1f5f9; color:#64748b"
+        styled = (grid.style
+                  .format({"CONTACT": lambda d: d.strftime('%d %b %y') if pd.notna(d) else '-'})
+                  .map(badge, subset=["STATUT"])
+                  .apply(lambda c: np.where(stale, "color:#ef4444; font-weight:700", "color:#64748b; font-weight:700"), subset=["CONTACT"])
+                  .map(sample_badge, subset=["SAMPLES"])
+                  .set_properties(subset=["SOCIÉTÉ"], **{"color": "#047857", "font-weight": "800"})
+                  .set_properties(subset=["PRODUIT"], **{"color": "#047857", "font-weight": "700"}))
+        # Одна таблица вместо контейнера и кнопки на каждую строку; выбор строки открывает карточку
+        ev = st.dataframe(styled, key=f"pipe_grid_{st.session_state['pipeline_key']}", on_select="rerun", selection_mode="single-row",
+                          hide_index=True, use_container_width=True, height=min(38 + 35 * len(grid), 740))
+        if ev.selection.rows:
+            st.session_state['active_prospect_id'] = int(df.iloc[ev.selection.rows[0]]['id'])
+            st.session_state['pipeline_key'] += 1; st.rerun()
+
+    n_pages = max(1, -(-total // page_size))
+    st.session_state['pipe_page'] = min(st.session_state.get('pipe_page', 1), n_pages)
+    pg1, pg2, pg3 = st.columns([1, 1, 4])
+    with pg1: st.number_input("Page", min_value=1, max_value=n_pages, step=1, key="pipe_page")
+    with pg2: st.selectbox("Lignes / page", [25, 50, 100, 200], index=1, key="pipe_size")
+    with pg3: st.markdown(f"<div style='color:#64748b; font-size:13px; padding-top:34px; text-align:right;'>{total} prospects • page {st.session_state['pipe_page']} / {n_pages}</div>", unsafe_allow_html=True)
+    ex1, ex2 = st.columns([1, 3])
+    with ex1:
+        if st.button("⬇ Préparer l'export XLSX", use_container_width=True):
+            with st.spinner("Export en cours..."), tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
+                counts = export_workbook(tmp.name, p_f, s_f, py_f)
+                st.session_state['export_xlsx'] = ((p_f, s_f, py_f), tmp.read(), counts)
+    exp = st.session_state.get('export_xlsx')
+    if exp and exp[0] == (p_f, s_f, py_f):
+        with ex2:
+            st.download_button(f"💾 Télécharger ({' • '.join(f'{k}: {v}' for k, v in exp[2].items())})", exp[1], file_name=f"ingood_export_{datetime.now():%Y%m%d}.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    st.write("")
+    render_bulk_drafts("pipeline", f"{total} prospects filtrés", lambda: get_draft_targets(p_f, s_f, py_f))
 
 # --- PAGE: KANBAN (ИНТЕРАКТИВНЫЙ ДВИЖОК) ---
 elif sel == "Kanban":
     st.title("Board Commercial ▦")
+    settle_kanban_moves()
     df = get_data()
     stages = ["Prospection", "Qualification", "Echantillon", "Test R&D", "Négociation", "Client signé"]
+    moves = st.session_state.get('kanban_moves', {})
+    if moves: kanban_moves_watch()
+    if moves and not df.empty:
+        df['status'] = df['id'].map({p: m['status'] for p, m in moves.items()}).fillna(df['status'])
+    # Раскладка по колонкам за один векторный проход (первая найденная стадия в статусе)
+    stage = df['status'].str.extract(f"({'|'.join(re.escape(x) for x in stages)})", expand=False) if not df.empty else pd.Series(dtype=object)
+    buckets = df.groupby(stage, sort=False).indices if not df.empty else {}
+    limits = st.session_state.setdefault('kanban_limit', {})
     cols = st.columns(len(stages))
     for i, s_n in enumerate(stages):
         with cols[i]:
-            st.markdown(f"<p style='font-weight:800; color:#047857; font-size:11px; border-bottom:3px solid #047857; padding-bottom:5px;'>{s_n.upper()}</p>", unsafe_allow_html=True)
-            mask = df['status'].str.contains(s_n, na=False)
-            for _, row in df[mask].iterrows():
+            idx = buckets.get(s_n, [])
+            st.markdown(f"<p style='font-weight:800; color:#047857; font-size:11px; border-bottom:3px solid #047857; padding-bottom:5px;'>{s_n.upper()} <span style='color:#94a3b8;'>{len(idx)}</span></p>", unsafe_allow_html=True)
+            lim = limits.get(s_n, KANBAN_COLUMN_LIMIT)
+            for _, row in df.iloc[idx[:lim]].iterrows():
                 with st.container():
                     st.markdown(f"""<div class='kanban-card'>
-                        <div style='font-weight:700; color:#1e293b;'>{row['company_name']}</div>
-                        <div style='font-size:10px; color:#64748b;'>🌍 {row['country'] or 'N/A'}</div>
+                        <div style='font-weight:700; color:#1e293b;'>{row['company_name']}{' ⏳' if row['id'] in moves else ''}</div>
+                        <div style='font-size:10px; color:#64748b;'>🌍 {row['country'] if pd.notna(row['country']) else 'N/A'}</div>
                         <div style='font-size:10px; font-weight:600; color:#047857;'>📦 {clean_prod_name(row['product_interest'])}</div>
                         <div class='kanban-potential'>{int(row.get('potential_volume', 0))} T</div>
                     </div>""", unsafe_allow_html=True)
                     km1, km2, km3 = st.columns([1, 2, 1])
                     with km1:
-                        if i > 0 and st.button("←", key=f"prev_{row['id']}"):
-                            supabase.table("prospects").update({"status": stages[i-1]}).eq("id", row['id']).execute(); reset_pipeline(); st.rerun()
+                        if i > 0 and st.button("←", key=f"prev_{row['id']}", disabled=row['id'] in moves):
+                            move_prospect(row['id'], row['status'], stages[i-1]); st.rerun()
                     with km2:
                         if st.button("Ouvrir", key=f"kb_{row['id']}", use_container_width=True):
                             st.session_state['active_prospect_id'] = row['id']; st.rerun()
                     with km3:
-                        if i < len(stages)-1 and st.button("→", key=f"next_{row['id']}"):
-                            supabase.table("prospects").update({"status": stages[i+1]}).eq("id", row['id']).execute(); reset_pipeline(); st.rerun()
+                        if i < len(stages)-1 and st.button("→", key=f"next_{row['id']}", disabled=row['id'] in moves):
+                            move_prospect(row['id'], row['status'], stages[i+1]); st.rerun()
+            if len(idx) > lim and st.button(f"Afficher plus ({len(idx) - lim})", key=f"kb_more_{s_n}", use_container_width=True):
+                limits[s_n] = lim + KANBAN_COLUMN_LIMIT; st.rerun()
 
 # --- PAGE: DASHBOARD (ADVANCED ANALYTICS) ---
 elif sel == "Dashboard":
     st.title("Analytics Growth ❒")
-    df = get_data()
-    if not df.empty:
+    hist = get_snapshot_history()
+    roll = hist[-1]["rollup"] if hist else {}
+    if roll.get("total"):
+        def kpis(r):
+            n, t = r.get("total", {}).get("all", [0, 0])
+            st_c = {k: c[0] for k, c in r.get("status", {}).items()}
+            return n, t, int(st_c.get('Client signé', 0) / n * 100) if n else 0, sum(c for k, c in st_c.items() if 'Test' in k)
+        now_k = kpis(roll)
+        week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
+        prev = next((h["rollup"] for h in reversed(hist) if h["day"] <= week_ago), None)
+        prev_k = kpis(prev) if prev else None
+        d = lambda i: None if prev_k is None else now_k[i] - prev_k[i]
         m1, m2, m3, m4 = st.columns(4)
-        m1.metric("Projets Actifs", len(df))
-        m2.metric("Potentiel (T)", f"{int(df['potential_volume'].sum())} T")
-        signed = len(df[df['status']=='Client signé'])
-        m3.metric("Win Rate", f"{int(signed/len(df)*100) if len(df)>0 else 0}%")
-        m4.metric("Samples в R&D", len(df[df['status'].str.contains('Test', na=False)]))
+        m1.metric("Projets Actifs", now_k[0], d(0))
+        m2.metric("Potentiel (T)", f"{int(now_k[1])} T", None if prev_k is None else f"{int(d(1))} T")
+        m3.metric("Win Rate", f"{now_k[2]}%", None if prev_k is None else f"{d(2)}%")
+        m4.metric("Samples в R&D", now_k[3], d(3))
         
+        prod_now = rollup_frame(hist[-1:], "product_interest")
         ca, cb = st.columns(2)
         with ca:
-            st.plotly_chart(px.pie(df, names='product_interest', hole=.4, title="Mix Produits (Volume)", color_discrete_sequence=px.colors.sequential.Greens_r), use_container_width=True)
+            st.plotly_chart(px.pie(prod_now, names='product_interest', values='count', hole=.4, title="Mix Produits (Volume)", color_discrete_sequence=px.colors.sequential.Greens_r), use_container_width=True)
         with cb:
             # Распределение ТОННАЖА по продуктам
-            ton_df = df.groupby('product_interest')['potential_volume'].sum().reset_index()
-            st.plotly_chart(px.bar(ton_df, x='product_interest', y='potential_volume', title="Potentiel Stratégique (Tons)", color_discrete_sequence=['#047857']), use_container_width=True)
+            st.plotly_chart(px.bar(prod_now, x='product_interest', y='tonnage', title="Potentiel Stratégique (Tons)", color_discrete_sequence=['#047857']), use_container_width=True)
+
+        # Динамика по неделям: последний срез каждой недели
+        if len(hist) > 1:
+            def weekly(f):
+                f['week'] = pd.to_datetime(f['day']).dt.to_period('W').dt.start_time
+                return f[f['day'] == f.groupby('week')['day'].transform('max')]
+            cc, cd = st.columns(2)
+            with cc:
+                fun = weekly(rollup_frame(hist, "status"))
+                st.plotly_chart(px.area(fun, x='week', y='count', color='status', title="Évolution du Funnel (hebdo)", color_discrete_sequence=px.colors.sequential.Greens_r), use_container_width=True)
+            with cd:
+                ton = weekly(rollup_frame(hist, "product_interest"))
+                st.plotly_chart(px.line(ton, x='week', y='tonnage', color='product_interest', markers=True, title="Tonnage par Produit (hebdo)", color_discrete_sequence=['#047857', '#10b981', '#64748b']), use_container_width=True)
+        else: st.caption("📈 Les tendances hebdomadaires apparaîtront après plusieurs jours de snapshots.")
 
 # --- PAGE: CONTACTS (JOIN LOGIC) ---
 elif sel == "Contacts":
     st.title("Annuaire Global 👤")
     search_q = st.text_input("🔍 Rechercher...", placeholder="Nom, Poste, Entreprise...")
-    # JOIN LOGIC: Название компании из таблицы prospects
-    cons = pd.DataFrame(supabase.table("contacts").select("*, prospects(company_name)").execute().data)
-    if not cons.empty:
-        cons['Entreprise'] = cons['prospects'].apply(lambda x: x['company_name'] if x else '-')
-        disp = cons[['name', 'role', 'email', 'phone', 'Entreprise']]
-        if search_q: disp = disp[disp.apply(lambda r: search_q.lower() in r.astype(str).str.lower().values, axis=1)]
-        st.dataframe(disp, use_container_width=True, height=600)
+    # JOIN LOGIC: Название компании из таблицы prospects (индекс строится один раз на версию данных)
+    idx = get_contact_index()
+    if idx is not None:
+        disp = idx.frame.iloc[idx.search(search_q)] if search_q else idx.frame
+        if search_q and disp.empty: st.info("Aucun résultat.")
+        else: st.dataframe(disp, use_container_width=True, height=600, hide_index=True)
     else: st.info("Aucun contact enregistré.")
 
 # --- PAGE: SAMPLES (JOIN LOGIC) ---
 elif sel == "Samples":
     st.title("Gestion des Échantillons 🧪")
-    samp = pd.DataFrame(supabase.table("samples").select("*, prospects(company_name)").execute().data)
+    samp = get_joined("samples")
     if not samp.empty:
-        samp['Client'] = samp['prospects'].apply(lambda x: x['company_name'] if x else '-')
         st.dataframe(samp[['date_sent', 'product_name', 'reference', 'status', 'Client', 'feedback']], use_container_width=True)
     else: st.info("Aucun échantillon envoyé.")
 
 # --- PAGE: ALERTS ---
 elif sel == "Alertes":
     st.title("Relances Prioritaires 🔔")
-    fifteen_days_ago = (datetime.now() - timedelta(days=15)).isoformat()
-    al = pd.DataFrame(supabase.table("samples").select("*, prospects(company_name)").is_("feedback", "null").lte("date_sent", fifteen_days_ago).execute().data)
+    res, rules = get_alerts(), alert_rules()
+    al = res["alerts"]
     if not al.empty:
-        al['Client'] = al['prospects'].apply(lambda x: x['company_name'] if x else '-')
-        for _, alert in al.iterrows():
-            with st.container(border=True):
-                a1, a2 = st.columns([4, 1])
-                a1.markdown(f"🚨 **{alert['Client']}** — {alert['product_name']} envoyé le {alert['date_sent'][:10]}. **Sans retour R&D с 15+ дней.**")
-                if a2.button("Ouvrir Fiche", key=f"al_btn_{alert['id']}"):
-                    st.session_state['active_prospect_id'] = alert['prospect_id']; st.rerun()
+        for col, (k, r) in zip(st.columns(len(rules)), rules.items()):
+            col.metric(f"{r['label']} ({r['days']}j+)" if r['days'] else f"{r['label']} (off)", res["counts"].get(k, 0))
+        render_bulk_drafts("alertes", f"{res['prospects']} prospects en relance", lambda: get_draft_targets(ids=al['prospect_id'].unique().tolist()))
+        st.write("")
+        # Таблица на правило вместо контейнера с кнопкой на каждый алерт; выбор строки открывает карточку
+        for tab, k in zip(st.tabs([f"{r['label']} ({res['counts'].get(k, 0)})" for k, r in rules.items()]), rules):
+            with tab:
+                hit = al[al['rule'] == k]
+                if hit.empty: st.success("Rien à relancer.")
+                else:
+                    ev = st.dataframe(hit[['company_name', 'detail', 'since', 'days']].rename(columns={"company_name": "SOCIÉTÉ", "detail": "DÉTAIL", "since": "DEPUIS", "days": "JOURS"}),
+                                      key=f"al_grid_{k}_{st.session_state['pipeline_key']}", on_select="rerun", selection_mode="single-row", hide_index=True,
+                                      use_container_width=True, height=min(38 + 35 * len(hit), 740), column_config={"DEPUIS": st.column_config.DateColumn(format="DD MMM YY")})
+                    if ev.selection.rows:
+                        st.session_state['active_prospect_id'] = int(hit.iloc[ev.selection.rows[0]]['prospect_id'])
+                        st.session_state['pipeline_key'] += 1; st.rerun()
     else: st.success("Félicitations ! Toutes ваши уведомления отработаны.")
+
+# --- PAGE: IMPORT (SALONS) ---
+elif sel == "Import":
+    st.title("Import de Leads ⇪")
+    st.caption("CSV ou XLSX : Société, Pays, Statut, Produit, Application, Potentiel, Site web, Salon, Contact, Poste, Email, Tel")
+    up = st.file_uploader("Fichier de leads", type=["csv", "xlsx"], label_visibility="collapsed")
+    i1, i2 = st.columns([2, 1])
+    with i1: salon = st.text_input("Salon (source par défaut)", placeholder="SIAL Paris 2026...")
+    with i2: attach = st.checkbox("Ajouter les contacts aux sociétés existantes", value=True)
+    if up is not None:
+        try: raw = read_import_file(up)
+        except Exception as e: st.error(f"Fichier illisible: {e}"); st.stop()
+        plan = plan_import(raw, salon, get_company_index())
+        counts = plan['action'].value_counts()
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Lignes", len(plan)); m2.metric("Nouveaux", int(counts.get("nouveau", 0)))
+        m3.metric("Doublons", int(counts.get("doublon (base)", 0) + counts.get("doublon (fichier)", 0))); m4.metric("Invalides", int(counts.get("invalide", 0)))
+        st.dataframe(plan[['action', 'erreurs', 'company_name', 'country', 'status', 'product_interest', 'segment', 'potential_volume', 'last_salon', 'contact_name', 'contact_email']],
+                     use_container_width=True, height=400, hide_index=True)
+        if st.button("Importer", type="primary", disabled=not (counts.get("nouveau", 0) or attach)):
+            with st.spinner("Import en cours..."):
+                n_p, n_c = run_import(plan, attach)
+            st.success(f"{n_p} prospect(s) et {n_c} contact(s) importés.")
+
+# --- PAGE: PERF ---
+elif sel == "Perf":
+    st.title("Performance ⏱")
+    store = _perf_store()
+    pct = lambda s, q: round(float(np.percentile(s, q)), 1) if len(s) else 0.0
+    runs, qs = pd.DataFrame(list(store["runs"])), pd.DataFrame(list(store["queries"]))
+    k1, k2, k3, k4 = st.columns(4)
+    if not runs.empty:
+        k1.metric("Rerun p50", f"{pct(runs['ms'], 50):.0f} ms"); k2.metric("Rerun p95", f"{pct(runs['ms'], 95):.0f} ms")
+        k3.metric("Requêtes / rerun", f"{runs['queries'].mean():.1f}"); k4.metric("Exceptions", len(store["errors"]))
+    if st.button("↺ Réinitialiser les mesures"):
+        for k in ("queries", "sections", "runs", "errors"): store[k].clear()
+        with store["lock"]: store["cache"].clear()
+        st.rerun()
+    t_q, t_r, t_s, t_c, t_e = st.tabs(["Requêtes", "Reruns", "Sections", "Cache", "Exceptions"])
+    with t_q:
+        if qs.empty: st.info("Aucune requête mesurée.")
+        else:
+            agg = qs.groupby('query').agg(n=('ms', 'size'), p50=('ms', lambda s: pct(s, 50)), p95=('ms', lambda s: pct(s, 95)), p99=('ms', lambda s: pct(s, 99)),
+                                          max=('ms', 'max'), rows=('rows', 'mean'), kb=('bytes', lambda s: s.mean() / 1024), errors=('ok', lambda s: int((~s).sum())))
+            st.dataframe(agg.sort_values('p95', ascending=False).round(1), use_container_width=True)
+            st.markdown("**Requêtes les plus lentes**")
+            st.dataframe(qs.nlargest(20, 'ms')[['ts', 'query', 'ms', 'rows', 'bytes', 'ok']].round({'ms': 1}), use_container_width=True, hide_index=True)
+    with t_r:
+        if runs.empty: st.info("Aucun rerun mesuré.")
+        else:
+            by_page = runs.groupby('page').agg(n=('ms', 'size'), p50=('ms', lambda s: pct(s, 50)), p95=('ms', lambda s: pct(s, 95)),
+                                               queries=('queries', 'mean'), db_ms=('db_ms', 'mean'), hits=('hits', 'mean'), misses=('misses', 'mean'))
+            st.dataframe(by_page.round(1), use_container_width=True)
+            st.dataframe(runs.tail(50).iloc[::-1].round({'ms': 1, 'db_ms': 1}), use_container_width=True, hide_index=True)
+    with t_s:
+        sec = pd.DataFrame(list(store["sections"]))
+        if sec.empty: st.info("Aucune section mesurée.")
+        else: st.dataframe(sec.groupby('section')['ms'].agg(n='size', p50=lambda s: pct(s, 50), p95=lambda s: pct(s, 95), max='max').round(1), use_container_width=True)
+    with t_c:
+        with store["lock"]: cache = pd.DataFrame([(f, c, m) for f, (c, m) in store["cache"].items()], columns=['fonction', 'appels', 'misses'])
+        if cache.empty: st.info("Aucun appel de cache.")
+        else:
+            cache['hit %'] = (100 * (1 - cache['misses'] / cache['appels'])).round(1)
+            st.dataframe(cache.sort_values('appels', ascending=False), use_container_width=True, hide_index=True)
+    with t_e:
+        if store["errors"]: st.dataframe(pd.DataFrame(list(store["errors"])).iloc[::-1], use_container_width=True, hide_index=True)
+        else: st.success("Aucune exception interceptée.")
+
+_perf_store()["sections"].append({"ts": datetime.now(), "section": f"page:{sel}", "ms": (time.perf_counter() - _page_t0) * 1000})
+perf_end(sel)
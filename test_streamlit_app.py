@@ -0,0 +1,479 @@
+"""Тесты логики streamlit_app.py на локальных заглушках (fake_supabase / fake_gemini).
+
+Приложение импортируется в bare-режиме Streamlit: скрипт выполняется один раз, вызовы st.* ничего не рисуют.
+Запуск: python -m pytest -q
+"""
+import io
+import os
+import sys
+from concurrent.futures import Future
+
+os.environ.update(INGOOD_FAKE_DB="1", INGOOD_FAKE_AI="1", FAKE_DB_SIZE="50,100,60,40", FAKE_AI_DELAY="0")
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE); os.chdir(HERE)  # favicon.png открывается относительно папки приложения
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import streamlit_app as app
+from fake_gemini import FakeGenerativeModel
+from fake_supabase import FakeClient, generate
+
+db = app.supabase.client  # общий FakeClient приложения
+
+
+@pytest.fixture
+def own_db(monkeypatch):
+    """Отдельная маленькая база для функций, которые ходят в supabase напрямую"""
+    client = FakeClient(generate(40, 80, 40, 20, seed=2))
+    monkeypatch.setattr(app, "supabase", client)
+    return client
+
+
+@pytest.fixture
+def session():
+    """st.session_state в bare-режиме — общий словарь процесса: буферы сессии очищаются до и после теста"""
+    ss = app.st.session_state
+    ss['pending_samples'], ss['kanban_moves'] = {}, {}
+    yield ss
+    ss['pending_samples'], ss['kanban_moves'] = {}, {}
+
+
+class CsvUpload(io.StringIO):
+    name = "salon.csv"
+
+
+def wait_until(cond, timeout=5):
+    """Ожидание фоновых потоков приложения"""
+    deadline = app.time.time() + timeout
+    while not cond() and app.time.time() < deadline: app.time.sleep(0.01)
+    return cond()
+
+
+class CountingRate:
+    def __init__(self): self.n = 0
+    def acquire(self): self.n += 1
+
+
+def ai_state():
+    """Свежее состояние AI вместо общего _ai_state(): без кэша, упавших уровней и реального лимита в минуту"""
+    return {"lock": app.threading.Lock(), "models": {}, "failed": {}, "cache": {}, "rate": CountingRate()}
+
+# --- live store ---
+def test_feed_deltas_reach_live_table_and_bump_versions():
+    client = FakeClient(generate(20, 30, 20, 10, seed=1))
+    store = app.LiveStore(client, app.FeedSource(client.changes))
+    assert len(store.frame("prospects")) == 20
+    v, vp = app.data_version("prospects"), app.data_version("prospects", 3)
+
+    client.table("prospects").update({"country": "Japon"}).eq("id", 3).execute()
+    client.table("prospects").delete().eq("id", 4).execute()
+    new = client.table("prospects").insert({"company_name": "Nouveau", "status": "Prospection"}).execute().data[0]["id"]
+    store.sync()
+
+    df = store.frame("prospects").set_index("id")
+    assert df.loc[3, "country"] == "Japon" and 4 not in df.index and df.loc[new, "company_name"] == "Nouveau"
+    assert app.data_version("prospects") == v + 1 and app.data_version("prospects", 3) == vp + 1
+    store.sync()  # лента уже прочитана: версии не меняются
+    assert app.data_version("prospects") == v + 1
+
+
+def test_live_table_ignores_noop_update():
+    lt = app.LiveTable("prospects", [{"id": 1, "status": "Prospection"}], "id, status")
+    assert lt.apply("UPDATE", {"id": 1, "status": "Prospection", "notes": "hors projection"}) is None
+    assert lt.apply("DELETE", {"id": 2}) is None
+    assert lt.rev == 0
+
+
+# --- import salons ---
+def test_plan_import():
+    existing = db.tables["prospects"][0]["company_name"]
+    csv = ("Société;Pays;Statut;Potentiel\n"
+           f"{existing};France;;\n"
+           "Boulangerie Dupont SAS;France;qualification;12,5\n"
+           "boulangerie  dupont;France;;\n"
+           "SARL;France;;\n"
+           ";France;;\n"
+           "Autre;France;Inconnu;beaucoup\n")
+    plan = app.plan_import(app.read_import_file(CsvUpload(csv)), "Salon Test", app.get_company_index())
+    assert plan["action"].tolist() == ["doublon (base)", "nouveau", "doublon (fichier)", "invalide", "invalide", "invalide"]
+    assert plan.loc[1, "status"] == "Qualification" and plan.loc[1, "potential_volume"] == 12.5
+    assert plan.loc[1, "last_salon"] == "Salon Test"
+    assert "Statut inconnu" in plan.loc[5, "erreurs"] and "Potentiel invalide" in plan.loc[5, "erreurs"]
+
+
+def test_run_import_twice_adds_nothing():
+    csv = ("Société;Pays;Contact;Email\n"
+           "Pâtisserie Quokka SAS;France;Jean Quokka;J@quokka.fr\n"
+           "Patisserie Quokka;France;Jean  Quokka;\n"
+           "Pâtisserie Quokka;France;Marie Quokka;m@quokka.fr\n"
+           "SA;France;Personne;\n")
+    plan = lambda: app.plan_import(app.read_import_file(CsvUpload(csv)), "Salon Test", app.get_company_index())
+    assert app.run_import(plan()) == (1, 2)  # одна компания; Jean без email — тот же контакт по имени
+    again = plan()
+    assert again["action"].tolist()[:3] == ["doublon (base)"] * 3 and again.loc[3, "action"] == "invalide"
+    assert app.run_import(again) == (0, 0)
+    pid = next(p["id"] for p in db.tables["prospects"] if p["company_name"] == "Pâtisserie Quokka SAS")
+    assert sorted(c["name"] for c in db.tables["contacts"] if c["prospect_id"] == pid) == ["Jean Quokka", "Marie Quokka"]
+
+
+
+# --- срезы воронки ---
+def test_snap_add_matches_full_rollup():
+    rows = [{"status": "Prospection", "product_interest": "A", "segment": "S", "country": "FR", "last_salon": None, "potential_volume": 10},
+            {"status": "Qualification", "product_interest": "A", "segment": None, "country": "FR", "last_salon": "X", "potential_volume": 5}]
+    rows = [{d: r.get(d) for d in app.SNAPSHOT_DIMS} | {"potential_volume": r["potential_volume"]} for r in rows]
+    rollup = {}
+    for r in rows: app._snap_add(rollup, app._snap_member(r), 1)
+    assert rollup == app._rollup_from_frame(pd.DataFrame(rows))
+
+    app._snap_add(rollup, app._snap_member(rows[1]), -1)
+    assert rollup == app._rollup_from_frame(pd.DataFrame(rows[:1]))  # пустые группы удаляются
+    app._snap_add(rollup, app._snap_member(rows[0]), -1)
+    assert all(not v for v in rollup.values())
+
+
+def test_refresh_snapshot_incremental(own_db):
+    truth = lambda: app._rollup_from_frame(pd.DataFrame(own_db.tables["prospects"]))
+    rounded = lambda r: {d: {k: [n, round(t, 3)] for k, (n, t) in x.items()} for d, x in r.items()}
+    assert rounded(app.refresh_snapshot()) == rounded(truth())
+
+    own_db.reset_log()
+    assert rounded(app.refresh_snapshot()) == rounded(truth())
+    assert not [l for l in own_db.log if l["table"] == "pipeline_snapshot_members" and l["op"] != "select"]  # без изменений вклады не пишутся
+
+    own_db.table("prospects").update({"status": "Négociation", "potential_volume": 999}).eq("id", 5).execute()
+    own_db.table("prospects").delete().eq("id", 7).execute()
+    own_db.table("prospects").insert({"company_name": "Nouveau", "status": "Prospection"}).execute()
+    own_db.reset_log()
+    assert rounded(app.refresh_snapshot()) == rounded(truth())
+    ups = [l for l in own_db.log if l["table"] == "pipeline_snapshot_members" and l["op"] == "upsert"]
+    assert sum(l["rows"] for l in ups) == 2  # только измененный и новый проспект
+
+
+class NoThread:
+    def __init__(self, **kw): pass
+    def start(self): pass
+
+
+def test_realtime_catches_up_and_reconciles(monkeypatch):
+    monkeypatch.setattr(app.threading, "Thread", NoThread)  # без сетевого канала: состояние и события задаются вручную
+    client = FakeClient(generate(20, 30, 20, 10, seed=3))
+    src = app.RealtimeSource("http://localhost", "key", app.LIVE_TABLES, app.PollingSource(client))
+    store = app.LiveStore(client, src)
+    status = lambda pid: store.frame("prospects").set_index("id").loc[pid, "status"]
+    store.frame("prospects"); store.sync()  # до подписки — опрос
+
+    client.table("prospects").update({"status": "Négociation"}).eq("id", 3).execute()  # правка до подписки
+    src.state = "SUBSCRIBED"; store.sync()
+    assert status(3) == "Négociation"  # догоняющий опрос сразу после подписки
+
+    client.table("prospects").update({"status": "Client signé"}).eq("id", 5).execute()  # событие не пришло
+    store.sync()
+    assert status(5) != "Client signé"  # до сверки только события канала
+    src._on_change({"data": {"type": "UPDATE", "table": "prospects", "record": {"id": 6, "status": "Test R&D"}}})
+    store.sync()
+    assert status(6) == "Test R&D"
+
+    src.fallback.last -= app.LIVE_RECONCILE
+    store.sync()
+    assert status(5) == "Client signé"  # сверочный опрос
+
+
+class FlakyClient:
+    def __init__(self, client): self.client, self.down = client, True
+
+    def table(self, t):
+        if self.down: raise ConnectionError("Supabase indisponible")
+        return self.client.table(t)
+
+
+def test_live_store_load_failure_gives_empty_frame():
+    client = FakeClient(generate(20, 30, 20, 10, seed=4))
+    flaky = FlakyClient(client)
+    store = app.LiveStore(flaky, app.FeedSource(client.changes))
+    df = store.frame("prospects")
+    assert df.empty and "status" in df.columns
+    assert any(e["where"] == "live_load:prospects" for e in app._perf_store()["errors"])
+
+    flaky.down = False
+    assert store.frame("prospects").empty  # повтор не раньше LIVE_RETRY
+    store.failed["prospects"] -= app.LIVE_RETRY
+    v = app.data_version("prospects")
+    assert len(store.frame("prospects")) == 20 and app.data_version("prospects") == v + 1
+
+
+# --- Pipeline ---
+def test_pipeline_pages_are_stable_on_ties(own_db):
+    for r in own_db.tables["prospects"]: r["last_action_date"] = "2024-01-01" if r["id"] % 3 else None
+    app._fetch_pipeline_page.clear()
+    pages = [app.get_pipeline_page(None, None, None, page, 15) for page in (1, 2, 3)]
+    ids = [i for df, _ in pages for i in df["id"]]
+    assert pages[0][1] == 40 and sorted(ids) == list(range(1, 41))  # без повторов и пропусков
+    nulls, dated = [i for i in range(40, 0, -1) if i % 3 == 0], [i for i in range(40, 0, -1) if i % 3]
+    assert ids == nulls + dated  # desc: NULL первыми, как в Postgres; равные даты — по id
+
+
+def test_export_workbook_pages_and_filters(own_db, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "EXPORT_PAGE", 7)  # несколько страниц на лист
+    path = str(tmp_path / "export.xlsx")
+    counts = app.export_workbook(path)
+    assert counts == {"Pipeline": 40, "Samples": 80, "Contacts": 40}
+    wb = openpyxl.load_workbook(path, read_only=True)
+    rows = list(wb["Samples"].values)
+    assert rows[0][0] == "company_name" and len(rows) == 81
+    names = {p["id"]: p["company_name"] for p in own_db.tables["prospects"]}
+    assert sorted(r[0] for r in rows[1:]) == sorted(names[s["prospect_id"]] for s in own_db.tables["samples"])
+
+    country = own_db.tables["prospects"][0]["country"]
+    mine = {p["id"] for p in own_db.tables["prospects"] if p["country"] == country}
+    counts = app.export_workbook(path, py_f=country)
+    assert counts == {"Pipeline": len(mine), "Samples": sum(s["prospect_id"] in mine for s in own_db.tables["samples"]),
+                      "Contacts": sum(c["prospect_id"] in mine for c in own_db.tables["contacts"])}
+
+
+# --- карточка ---
+def test_card_single_query_and_journal_pages():
+    pid, other = db.tables["prospects"][10]["id"], db.tables["prospects"][11]["id"]
+    db.table("activities").insert([{"prospect_id": pid, "type": "Note", "content": f"note {i}", "date": "2024-01-01"} for i in range(45)]).execute()
+    every = sorted((a["id"] for a in db.tables["activities"] if a["prospect_id"] == pid), reverse=True)
+
+    db.reset_log()
+    card = app.get_card(pid)
+    assert [(l["table"], l["op"]) for l in db.log] == [("prospects", "select")]  # один запрос со встроенными таблицами
+    assert card["prospect"]["id"] == pid and card["more"]
+    assert [a["id"] for a in card["activities"]] == every[:app.JOURNAL_PAGE]
+    assert {c["id"] for c in card["contacts"]} == {c["id"] for c in db.tables["contacts"] if c["prospect_id"] == pid}
+
+    p1, p2 = app.get_journal(pid, 1), app.get_journal(pid, 2)
+    assert len(p1) == app.JOURNAL_PAGE + 1  # +1 — признак следующей страницы
+    assert [a["id"] for a in card["activities"] + p1[:app.JOURNAL_PAGE] + p2] == every
+
+    db.reset_log()
+    app.get_card(pid); app.db_write("activities", other).insert({"prospect_id": other, "type": "Note", "content": "x"}).execute()
+    app.get_card(pid)
+    assert [l["table"] for l in db.log] == ["activities"]  # кэш карточки не сбрасывается чужими записями
+    app.db_write("activities", pid).insert({"prospect_id": pid, "type": "Note", "content": "nouvelle"}).execute()
+    assert app.get_card(pid)["activities"][0]["content"] == "nouvelle"
+
+
+# --- алерты ---
+def test_alerts_match_rules():
+    app.live_store().sync()  # правки других тестов напрямую в базу
+    day, rules = "2026-06-01", (("sample_feedback", 15), ("untouched", 30), ("stuck", 45))
+    age = lambda d: (pd.Timestamp(day) - pd.Timestamp(d[:10])).days if d else None
+    expect = []
+    for p in db.tables["prospects"]:
+        if (a := age(p.get("last_action_date"))) is not None and a >= 30: expect.append(("untouched", p["id"], a))
+        since = p.get("status_changed_at") or p.get("updated_at") or p.get("last_action_date")
+        if p["status"] not in app.ALERT_DONE_STATUSES and (a := age(since)) is not None and a >= 45: expect.append(("stuck", p["id"], a))
+    for s in db.tables["samples"]:
+        if s.get("feedback") is None and (a := age(s.get("date_sent"))) is not None and a >= 15: expect.append(("sample_feedback", s["prospect_id"], a))
+
+    res = app._alerts(day, rules, -1, -1)
+    al = res["alerts"]
+    assert sorted(zip(al["rule"], al["prospect_id"], al["days"])) == sorted(expect)
+    assert list(al["days"]) == sorted(al["days"], reverse=True)
+    assert res["counts"] == pd.Series([r for r, _, _ in expect]).value_counts().to_dict()
+    assert res["untouched"] == {pid for r, pid, _ in expect if r == "untouched"}
+
+    off = app._alerts(day, (("sample_feedback", 0), ("untouched", 30), ("stuck", 0)), -1, -1)
+    assert set(off["alerts"]["rule"]) <= {"untouched"}  # 0 — правило отключено
+
+
+def test_alerts_follow_writes():
+    app.live_store().sync()
+    pid = next(p["id"] for p in db.tables["prospects"] if p["id"] in app.get_alerts()["untouched"])
+    app.db_write("prospects", pid).update({"last_action_date": app.datetime.now().isoformat()}).eq("id", pid).execute()
+    assert pid not in app.get_alerts()["untouched"]
+
+
+# --- буфер правок образцов ---
+def edit_sample(session, row, field, value):
+    session[f"k_{row['id']}_{field}"] = value
+    app.queue_sample_edit(row, field, f"k_{row['id']}_{field}")
+
+
+def test_sample_edits_flush_as_grouped_updates(session):
+    a, b, c = [dict(r) for r in db.tables["samples"][:3]]
+    edit_sample(session, a, "status", "Validé"); edit_sample(session, b, "status", "Validé")
+    edit_sample(session, c, "feedback", "RAS"); edit_sample(session, c, "feedback", "Texture OK")  # слияние по id
+
+    db.reset_log()
+    assert app.flush_sample_edits() is None and db.log == []  # пауза SAMPLE_FLUSH_DELAY еще не прошла
+    assert app.flush_sample_edits(force=True)
+    assert sorted((l["op"], l["rows"]) for l in db.log if l["table"] == "samples") == [("update", 1), ("update", 2)]
+    cur = {r["id"]: r for r in db.tables["samples"]}
+    assert cur[a["id"]]["status"] == cur[b["id"]]["status"] == "Validé"
+    assert cur[c["id"]]["feedback"] == "Texture OK" and cur[c["id"]]["status"] == c["status"]
+    assert cur[a["id"]]["reference"] == a["reference"] and session["pending_samples"] == {}
+
+
+def test_sample_flush_keeps_other_fields_and_deleted_rows(session):
+    a, b = [dict(r) for r in db.tables["samples"][3:5]]
+    edit_sample(session, a, "status", "Rejeté"); edit_sample(session, b, "status", "Perdu")
+    db.table("samples").update({"feedback": "Avis plus récent"}).eq("id", a["id"]).execute()  # другой пользователь
+    db.table("samples").delete().eq("id", b["id"]).execute()
+
+    app.flush_sample_edits(force=True)
+    cur = {r["id"]: r for r in db.tables["samples"]}
+    assert cur[a["id"]]["status"] == "Rejeté" and cur[a["id"]]["feedback"] == "Avis plus récent"
+    assert b["id"] not in cur  # update не вставляет удаленный образец обратно
+    assert session["pending_samples"] == {}
+
+
+# --- Kanban ---
+def test_kanban_move_settles_after_write(session):
+    p = db.tables["prospects"][5]; pid, old = p["id"], p["status"]
+    app.move_prospect(pid, old, "Négociation")
+    fut = session["kanban_moves"][pid]["fut"]
+    app.move_prospect(pid, "Négociation", "Client signé")  # второй клик, пока первый перенос не разобран
+    assert session["kanban_moves"][pid]["fut"] is fut
+
+    assert wait_until(fut.done)
+    v = app.data_version("prospects", pid)
+    app.settle_kanban_moves()
+    assert session["kanban_moves"] == {} and app.data_version("prospects", pid) == v + 1
+    assert app.live_frame("prospects").set_index("id").loc[pid, "status"] == "Négociation"
+    assert next(r for r in db.tables["prospects"] if r["id"] == pid)["status"] == "Négociation"
+
+
+def test_kanban_move_rolls_back_on_error(session):
+    p = db.tables["prospects"][6]; pid, old = p["id"], p["status"]
+    fut = Future(); fut.set_exception(RuntimeError("réseau"))
+    session["kanban_moves"] = {pid: {"status": "Négociation", "prev": old, "fut": fut}}
+    v = app.data_version("prospects", pid)
+    app.settle_kanban_moves()
+    assert session["kanban_moves"] == {} and app.data_version("prospects", pid) == v
+    assert app.live_frame("prospects").set_index("id").loc[pid, "status"] == old
+
+
+def test_kanban_pending_move_is_kept(session):
+    session["kanban_moves"] = {1: {"status": "Négociation", "prev": "Prospection", "fut": Future()}}
+    app.settle_kanban_moves()
+    assert 1 in session["kanban_moves"]  # update еще в полете: ⏳ остается
+
+
+# --- AI ---
+def test_ai_fallback_and_cooldown(monkeypatch):
+    monkeypatch.setenv("FAKE_AI_FAIL", "gemini-1.5-flash+search,gemini-1.5-flash")
+    state = ai_state(); FakeGenerativeModel.calls.clear()
+
+    assert "(gemini-1.5-pro)" in app._ai_complete("A", "P", "T", "FR", state)
+    assert FakeGenerativeModel.calls == [("gemini-1.5-flash", True), ("gemini-1.5-flash", False), ("gemini-1.5-pro", False)]
+
+    FakeGenerativeModel.calls.clear()
+    app._ai_complete("B", "P", "T", "FR", state)
+    assert FakeGenerativeModel.calls == [("gemini-1.5-pro", False)]  # упавшие уровни пропускаются до AI_TIER_COOLDOWN
+
+    FakeGenerativeModel.calls.clear()
+    app._ai_complete("A", "P", "T", "FR", state)
+    assert FakeGenerativeModel.calls == []  # ответ из кэша
+
+
+def test_ai_unavailable(monkeypatch):
+    monkeypatch.setenv("FAKE_AI_FAIL", "gemini-1.5-flash+search,gemini-1.5-flash,gemini-1.5-pro")
+    with pytest.raises(app.AIUnavailable):
+        app._ai_complete("A", "P", "T", "FR", ai_state())
+
+
+def test_ai_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(app, "AI_CACHE_MAX", 3)
+    state = ai_state()
+    for c in "ABCDE": app._ai_complete(c, "P", "T", "FR", state)
+    assert [k[0] for k in state["cache"]] == ["C", "D", "E"]  # вытесняются самые старые
+
+
+def test_ai_job_streams_into_chunks():
+    job = app.start_ai_job("Boulangerie Paul", "LENGOOD®", "Direct", "France")
+    assert wait_until(lambda: job["done"]) and "Boulangerie Paul" in "".join(job["chunks"])
+
+
+def test_rate_limit_taken_per_model_call(monkeypatch):
+    monkeypatch.setenv("FAKE_AI_FAIL", "gemini-1.5-flash+search,gemini-1.5-flash")
+    state = ai_state()
+    app._ai_complete("A", "P", "T", "FR", state)
+    assert state["rate"].n == 3  # каждый уровень цепочки — отдельный вызов модели
+    app._ai_complete("B", "P", "T", "FR", state)
+    assert state["rate"].n == 4  # упавшие уровни в cooldown не тратят лимит
+    app._ai_complete("A", "P", "T", "FR", state)
+    assert state["rate"].n == 4  # ответ из кэша
+
+
+def test_rate_limiter_spaces_calls():
+    rate, t0 = app.RateLimiter(600), app.time.monotonic()
+    for _ in range(4): rate.acquire()
+    assert app.time.monotonic() - t0 >= 0.29  # 600/мин -> 0.1 с между вызовами
+
+
+def test_bulk_drafts_skip_already_drafted(own_db, monkeypatch):
+    state = ai_state()
+    monkeypatch.setattr(app, "_ai_state", lambda: state)
+    targets = app.get_draft_targets(ids=[1, 2, 3])
+
+    job = app.start_bulk_drafts(targets, "Direct", skip_days=7)
+    assert wait_until(lambda: job["finished"])
+    assert (job["done"], job["skipped"], job["failed"]) == (3, 0, 0)
+    drafts = [a for a in own_db.tables["activities"] if a["type"] == app.DRAFT_TYPE]
+    assert sorted(a["prospect_id"] for a in drafts) == [1, 2, 3]
+
+    job = app.start_bulk_drafts(targets, "Direct", skip_days=7)
+    assert wait_until(lambda: job["finished"])
+    assert (job["done"], job["skipped"]) == (0, 3)  # повторный запуск той же выборки
+    assert state["rate"].n == 3
+
+
+# --- recherche contacts ---
+def test_contact_index_search():
+    idx = app.ContactIndex(pd.DataFrame([
+        {"name": "Amélie Durand", "Entreprise": "Boulangerie Paul", "role": "Acheteur", "email": "a.durand@paul.fr", "phone": "+33 6 11 22 33 44"},
+        {"name": "Jean Martin", "Entreprise": "Sauces du Nord", "role": "R&D", "email": "jm@nord.fr", "phone": ""},
+        {"name": "Paul Durandal", "Entreprise": "Confiserie Zeta", "role": "CEO", "email": "", "phone": ""},
+    ]))
+    assert idx.search("amelie") == [0]                  # без акцентов
+    assert idx.search("durand") == [0, 2]               # точное совпадение выше префикса
+    assert idx.search("paul durand") == [0, 2]          # все слова должны совпасть
+    assert idx.search("marin") == [1]                   # опечатка через триграммы
+    assert idx.search("3361122") == [0]                 # телефон целиком, префикс номера
+    assert idx.search("xyz") == [] and idx.search("") == [0, 1, 2]
+
+
+def test_contact_index_rebuilt_only_for_contacts_or_names():
+    pid = db.tables["prospects"][1]["id"]
+    app.db_write("contacts", pid).insert({"prospect_id": pid, "name": "Quentin Xylo", "role": "", "email": "", "phone": ""}).execute()
+    idx = app.get_contact_index()
+    assert idx.search("xylo") != []  # новый контакт попал в индекс
+
+    app.db_write("prospects", pid).update({"status": "Négociation"}).eq("id", pid).execute()
+    assert app.get_contact_index() is idx  # правка проспекта без смены названия
+
+    app.db_write("prospects", pid).update({"company_name": "Zygomatique Foods"}).eq("id", pid).execute()
+    assert app.get_contact_index() is not idx
+    assert "Quentin Xylo" in app.get_contact_index().frame.iloc[app.get_contact_index().search("zygomatique")]["name"].tolist()
+
+
+# --- контакты карточки ---
+def test_sync_contacts_sends_only_changes():
+    pid = db.tables["prospects"][0]["id"]
+    mine = [dict(c) for c in db.tables["contacts"] if c["prospect_id"] == pid][:2]
+    if len(mine) < 2:
+        db.table("contacts").insert([{"prospect_id": pid, "name": f"C{i}", "role": "", "email": "", "phone": ""} for i in range(2)]).execute()
+        mine = [dict(c) for c in db.tables["contacts"] if c["prospect_id"] == pid][:2]
+    keep, gone = mine
+    loaded = {c["id"]: dict(c) for c in mine}
+    edited = [{**keep, "email": "nouveau@x.fr"}, {"name": "Nouveau Contact"}, {"name": "  "}]
+    v = app.data_version("contacts", pid)
+
+    db.reset_log()
+    app.sync_contacts(pid, edited, loaded, [gone["id"]])
+    assert [(l["table"], l["op"], l["rows"]) for l in db.log] == [("contacts", "delete", 1), ("contacts", "upsert", 1), ("contacts", "insert", 1)]
+    cur = [c for c in db.tables["contacts"] if c["prospect_id"] == pid]
+    assert gone["id"] not in {c["id"] for c in cur}
+    assert next(c for c in cur if c["id"] == keep["id"])["email"] == "nouveau@x.fr"
+    assert any(c["name"] == "Nouveau Contact" for c in cur)
+    assert app.data_version("contacts", pid) > v
+
+    db.reset_log()
+    app.sync_contacts(pid, [{**keep, "email": "nouveau@x.fr"}], {keep["id"]: {**keep, "email": "nouveau@x.fr"}}, [])
+    assert db.log == []  # ничего не изменилось — запросов нет